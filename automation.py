@@ -0,0 +1,485 @@
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException, UnexpectedAlertPresentException, NoSuchElementException, NoAlertPresentException
+import os
+import time
+import logging
+
+import requests
+
+from driver_pool import DriverPool, unblock_resources
+from waits import WaitPolicy
+from image_store import ImageStore
+from http_engine import HttpFeedbackEngine, PortalError
+from login_cache import LoginCache, RunCheckpoint
+from sessions import RunCancelled, DEFAULT_ENGINE, DEFAULT_RATING
+
+# Root of the student portal; every page the automation visits lives below it
+PORTAL_BASE_URL = os.environ.get("PORTAL_BASE_URL", "https://bitwebserver.bittechlearn.online:8084/Students/")
+# How long a run holds its browser waiting for the user to type the CAPTCHA
+CAPTCHA_DEADLINE_SECONDS = int(os.environ.get("CAPTCHA_DEADLINE_SECONDS", "300"))
+# How long a run waits for a browser before telling the user they are all busy
+DRIVER_WAIT_NOTICE_SECONDS = 10
+# How long a prefetched session keeps its browser and CAPTCHA waiting for credentials
+WARM_SESSION_TTL_SECONDS = int(os.environ.get("WARM_SESSION_TTL_SECONDS", "90"))
+
+# Warm headless browsers shared by all runs; each run checks one out and returns it when done
+driver_pool = DriverPool()
+# CAPTCHA and failure screenshots, held in memory per run instead of written to static/
+run_images = ImageStore()
+# Encrypted portal logins and progress checkpoints per user, so retries skip the CAPTCHA and finished work.
+# In memory here; queue workers replace it with the job store's copy shared by every worker
+login_cache = LoginCache()
+
+def restore_cookies(driver, cookies):
+    # Cookies can only be added for the domain the browser is currently on
+    driver.get(PORTAL_BASE_URL)
+    for cookie in cookies:
+        cookie.pop("sameSite", None)
+        try:
+            driver.add_cookie(cookie)
+        except Exception as e:
+            logging.warning(f"Could not restore cookie {cookie.get('name')}: {e}")
+
+# Reads the whole feedback grid in one round trip: position, row key and status of every data row
+SCAN_GRID_SCRIPT = """
+const rows = document.querySelectorAll('#gvCustomers tbody tr');
+return Array.from(rows).map((row, index) => {
+    const cells = Array.from(row.querySelectorAll('td')).map(td => td.innerText.trim());
+    return {index: index, key: cells.slice(0, 3).join(' | '), status: cells.length > 3 ? cells[3] : null};
+});
+"""
+
+# Clicks the grid row at the given position if it still carries the expected key
+CLICK_GRID_ROW_SCRIPT = """
+const row = document.querySelectorAll('#gvCustomers tbody tr')[arguments[0]];
+if (!row) { return false; }
+const key = Array.from(row.querySelectorAll('td')).slice(0, 3).map(td => td.innerText.trim()).join(' | ');
+if (key !== arguments[1]) { return false; }
+row.click();
+return true;
+"""
+
+# Selects the given rating for every rdQ{n}_* question on FeedBack.aspx in one round trip and
+# reports how many questions there were and which ones could not be set
+FILL_RATINGS_SCRIPT = """
+const rating = arguments[0];
+const questions = new Set();
+document.querySelectorAll('input[type=radio][id^="rdQ"]').forEach(radio => {
+    const match = radio.id.match(/^rdQ(\\d+)_\\w+$/);
+    if (match) { questions.add(Number(match[1])); }
+});
+const missing = [];
+Array.from(questions).sort((a, b) => a - b).forEach(question => {
+    const radio = document.getElementById('rdQ' + question + '_' + rating);
+    if (!radio || radio.disabled) { missing.push(question); return; }
+    if (!radio.checked) { radio.click(); }
+    if (!radio.checked) { missing.push(question); }
+});
+return {questions: questions.size, missing: missing};
+"""
+
+def fill_feedback_form(driver, waits, rating):
+    # Sets every rating in one script and returns the submit button, which the caller clicks
+    # Waiting for the submit button also guarantees the questions above it have rendered
+    submit_btn = waits.until("feedback_form", EC.element_to_be_clickable((By.ID, "btn_submit")))
+    result = driver.execute_script(FILL_RATINGS_SCRIPT, rating)
+    if result["questions"] == 0:
+        raise RuntimeError("No rating questions found on FeedBack.aspx.")
+    if result["missing"]:
+        logging.warning(f"Could not set rating {rating} for questions {result['missing']}. Skipping them.")
+    logging.info(f"Set rating {rating} on {result['questions'] - len(result['missing'])} of {result['questions']} questions.")
+    return submit_btn
+
+def scan_grid(driver, waits):
+    waits.until("grid", EC.presence_of_element_located((By.ID, "gvCustomers")))
+    return [r for r in driver.execute_script(SCAN_GRID_SCRIPT) if r["status"] is not None]
+
+def handle_phase(session, driver, waits, feedback_button_id, phase_name, rating=DEFAULT_RATING, checkpoint=None):
+    with session.trace.span("phase", phase_name, driver):
+        _handle_phase(session, driver, waits, feedback_button_id, phase_name, rating, checkpoint)
+
+def _handle_phase(session, driver, waits, feedback_button_id, phase_name, rating, checkpoint):
+    session.update(f"Entering {phase_name}...", session.progress + 5)
+    round_trips_at_start = getattr(driver, "round_trips", 0)
+    submitted = 0
+    # Rows an earlier run already submitted count as one attempt, so they get one retry at most
+    attempts = {key: 1 for key in checkpoint.submitted_rows(phase_name)} if checkpoint else {}
+
+    waits.until("navigation", EC.element_to_be_clickable((By.ID, feedback_button_id))).click()
+    pending = [r for r in scan_grid(driver, waits) if r["status"] == "Pending"]
+
+    # Work through every pending row of the snapshot, then re-scan once to confirm nothing is left
+    while pending:
+        for record in pending:
+            session.raise_if_cancelled()
+            attempts[record["key"]] = attempts.get(record["key"], 0) + 1
+            if attempts[record["key"]] > 2:
+                raise RuntimeError(f"Feedback for '{record['key']}' in {phase_name} is still pending after submitting it twice.")
+
+            logging.info(f"Found pending item in {phase_name}, clicking row {record['index']}...")
+            session.update(f"Processing pending item in {phase_name}...", min(90, session.progress + 2))
+            detail = f"{phase_name}: {record['key']}"
+            with session.trace.span("feedback_fill", detail, driver):
+                waits.until("grid", EC.presence_of_element_located((By.ID, "gvCustomers")))
+                if not driver.execute_script(CLICK_GRID_ROW_SCRIPT, record["index"], record["key"]):
+                    logging.info(f"Row {record['index']} in {phase_name} moved since the scan, will pick it up on re-scan.")
+                    continue
+
+                waits.until("navigation", EC.url_contains("FeedBack.aspx"))
+                logging.info("On FeedBack.aspx, filling ratings...")
+                session.update("Filling ratings...", min(90, session.progress + 5))
+                submit_btn = fill_feedback_form(driver, waits, rating)
+
+            with session.trace.span("feedback_submit", detail, driver):
+                submit_btn.click()
+                submitted += 1
+                if checkpoint:
+                    checkpoint.row_submitted(phase_name, record["key"])
+                logging.info("Submitted feedback.")
+                session.update("Feedback submitted, navigating back...", min(90, session.progress + 5))
+
+                waits.until("navigation", EC.element_to_be_clickable((By.ID, "HyperLink1"))).click()
+
+                waits.until("navigation", EC.url_contains("SubjectTeacher.aspx"))
+                # Re-click the phase button to bring the grid back for the next row of the snapshot
+                waits.until("navigation", EC.element_to_be_clickable((By.ID, feedback_button_id))).click()
+                logging.info(f"Back to {phase_name} list.")
+
+        pending = [r for r in scan_grid(driver, waits) if r["status"] == "Pending"]
+
+    round_trips = getattr(driver, "round_trips", 0) - round_trips_at_start
+    logging.info(f"No more pending feedbacks in {phase_name}. Submitted {submitted} in {round_trips} WebDriver round trips.")
+    session.add_phase_report({"phase": phase_name, "engine": "selenium", "submitted": submitted, "round_trips": round_trips})
+    if checkpoint:
+        checkpoint.phase_done(phase_name)
+
+# Phase button id and name, in the order the portal expects them to be completed
+PHASES = (("btnPhase1Feedback", "Phase 1"), ("btnPhase2Feedback", "Phase 2"))
+
+def run_phases(session, checkpoint, run_phase):
+    for position, (feedback_button_id, phase_name) in enumerate(PHASES):
+        if position:
+            session.update("Phase 1 complete. Proceeding to Phase 2...", 70)
+            logging.info("Phase 1 complete. Proceeding to Phase 2...")
+        if checkpoint and checkpoint.is_phase_done(phase_name):
+            logging.info(f"{phase_name} was finished by an earlier run, skipping it.")
+            session.add_phase_report({"phase": phase_name, "skipped": "checkpoint"})
+            continue
+        run_phase(feedback_button_id, phase_name)
+
+def run_selenium_phases(session, driver, waits, rating, checkpoint=None):
+    run_phases(session, checkpoint, lambda button_id, phase_name: handle_phase(session, driver, waits, button_id, phase_name, rating, checkpoint))
+
+def run_http_phases(session, http, rating, checkpoint=None):
+    run_phases(session, checkpoint, lambda button_id, phase_name: http.handle_phase(button_id, phase_name, session, rating, checkpoint))
+
+def reuse_http_login(saved):
+    # Checks a saved login over plain HTTP; returns an engine already on SubjectTeacher.aspx, or None
+    cookies, user_agent = saved
+    http = HttpFeedbackEngine(PORTAL_BASE_URL, cookies, user_agent)
+    try:
+        page = http.get("SubjectTeacher.aspx")
+    except requests.RequestException as e:
+        logging.warning(f"Could not check saved portal login: {e}")
+        return None
+    # Logged out visitors get the login form on the same URL instead of the phase buttons
+    return http if page.find("btnPhase1Feedback") is not None else None
+
+def reuse_browser_login(driver, waits, saved):
+    # Loads a saved login into the browser; True if the portal accepted it
+    restore_cookies(driver, saved[0])
+    driver.get(PORTAL_BASE_URL + "SubjectTeacher.aspx")
+    waits.document_ready()
+    if driver.find_elements(By.ID, "btnPhase1Feedback"):
+        return True
+    driver.delete_all_cookies()
+    return False
+
+# Checks a browser out of the pool and stores it on the session. The pool holds runs back while its
+# memory-based limit is below the number of runs, and those can sit on a CAPTCHA for minutes, so
+# keep waiting for as long as the run is wanted instead of failing it after one acquire timeout.
+# It is a single acquire, so the pool's wait stats see the whole wait
+def acquire_driver(session):
+    started = time.time()
+    noticed = []
+
+    def check():
+        session.raise_if_cancelled()
+        if not noticed and time.time() - started >= DRIVER_WAIT_NOTICE_SECONDS:
+            noticed.append(True)
+            logging.info("No browser free yet, still waiting.")
+            session.update("All browsers are busy, waiting for one to free up...")
+
+    session.raise_if_cancelled()
+    with session.trace.span("driver_acquire"):
+        driver = driver_pool.acquire(timeout=None, check=check)
+    session.driver = driver
+    return driver
+
+# Opens the login page and puts its CAPTCHA on screen for the user
+def load_captcha(session, driver, waits):
+    logging.info("Navigating to login page.")
+    session.update("Navigating to login page...", 10)
+    with session.trace.span("page_load", source=driver):
+        driver.get(PORTAL_BASE_URL + "SubjectTeacher.aspx")
+        waits.document_ready()
+
+    with session.trace.span("captcha_capture", source=driver):
+        # --- Click "Click To Get Captcha" ---
+        try:
+            get_captcha_button = waits.until("captcha_button", EC.element_to_be_clickable((By.ID, "BTN_GetCaptcha0")))
+            # Wait for the click to actually bring a new image (postback or src swap) rather than sleeping
+            waits.src_changed_after("Image2", get_captcha_button.click, "captcha_button")
+            logging.info("Clicked 'Click To Get Captcha' button.")
+        except TimeoutException:
+            logging.warning("Warning: 'Click To Get Captcha' button not found or not clickable.")
+            # Continue without clicking if the button isn't there, might mean captcha is static
+
+        # Wait until the CAPTCHA image has actually been fetched and decoded (not just the placeholder src)
+        try:
+            waits.image_loaded("Image2", "captcha_image", placeholder_srcs=["StudentLogin.aspx"])
+        except TimeoutException:
+            if getattr(driver, "browser_profile", None) != "lean":
+                raise
+            # The CAPTCHA must always load: if the lean profile's block list caught it, lift the list and reload it
+            logging.warning("CAPTCHA image did not load with resource blocking on, retrying without it.")
+            unblock_resources(driver)
+            driver.execute_script("const img = document.getElementById('Image2'); if (img) { img.src = img.src; }")
+            waits.image_loaded("Image2", "captcha_image", placeholder_srcs=["StudentLogin.aspx"])
+        captcha_element = waits.until("captcha_image", EC.visibility_of_element_located((By.ID, "Image2")))
+        logging.info("Captcha image is loaded and visible with a valid source.")
+
+        # Take screenshot of the CAPTCHA from THIS live session
+        run_images.put(session.id, "captcha", captcha_element.screenshot_as_png)
+        logging.info("CAPTCHA image captured for user input.")
+    
+    # Signal the frontend that CAPTCHA is ready for input
+    session.update("CAPTCHA ready for input. Please solve.", 20, captcha_ready=True)
+    session.captcha_ready_event.set() # Set the event to indicate CAPTCHA is ready
+
+# Logs in with the CAPTCHA answer once the user sends it and ends on SubjectTeacher.aspx.
+# Returns None on success, or the run's error result
+def log_in(session, driver, waits, username, password):
+    with session.trace.span("captcha_wait"):
+        # --- PAUSE EXECUTION AND WAIT FOR USER CAPTCHA INPUT ---
+        logging.info("Automation paused, waiting for user to solve CAPTCHA...")
+        # Bounded wait: a closed tab must not hold a browser forever. Cancelling also sets the event
+        if not session.captcha_submitted_event.wait(CAPTCHA_DEADLINE_SECONDS):
+            session.cancel(f"CAPTCHA was not entered within {CAPTCHA_DEADLINE_SECONDS} seconds")
+        session.raise_if_cancelled()
+    
+        # Get the CAPTCHA solution from the queue
+        solved_captcha = session.captcha_solution_queue.get(timeout=10) # Get solution, wait a bit
+        session.captcha_solution_queue.task_done() # Mark task as done
+        logging.info(f"Received CAPTCHA solution from user. Length: {len(solved_captcha)}") # Log length, not value
+
+    # Reset the events immediately after getting the input
+    session.reset_captcha_events()
+    session.update("CAPTCHA received. Logging in...") # Update status immediately
+
+    with session.trace.span("login", source=driver):
+        # --- IMPORTANT: Re-find elements after the pause ---
+        # The page might have refreshed or elements might have become stale during the user interaction time.
+        # This prevents StaleElementReferenceException.
+        logging.info("Re-finding elements after CAPTCHA input...")
+        captcha_field = waits.until("login_form", EC.presence_of_element_located((By.ID, "txtVerificationCode")))
+        username_field = waits.until("login_form", EC.presence_of_element_located((By.ID, "TXTUSN")))
+        password_field = waits.until("login_form", EC.presence_of_element_located((By.ID, "TXTPASSWORD")))
+        login_button = waits.until("login_form", EC.element_to_be_clickable((By.ID, "btn_Login")))
+
+        # --- Fill the fields with the provided solution and credentials ---
+        captcha_field.send_keys(solved_captcha) # Use the received solution
+        logging.info("Filled CAPTCHA field.")
+
+        username_field.send_keys(username)
+        logging.info("Filled username field.")
+
+        password_field.send_keys(password)
+        logging.info("Filled password field.")
+    
+        # Client-side scripts may still be handling the inputs (validators can disable the button meanwhile);
+        # click once the page has loaded and the button is enabled. Scripts are free to rewrite the values
+        waits.document_ready("login_form")
+        login_button = waits.until("login_form", EC.element_to_be_clickable((By.ID, "btn_Login")))
+        login_button.click()
+        logging.info("Clicked login button. Waiting for redirection or error indication...")
+    
+        # --- Login Verification and Subsequent Automation Steps ---
+        try:
+            waits.until("login_redirect", EC.url_contains("StudentsCorner.aspx"))
+            logging.info("Login successful. Redirected to StudentsCorner.aspx.")
+            session.update("Login successful.", 30)
+            # The CAPTCHA is used up after a successful login
+            run_images.delete(session.id, "captcha")
+        except TimeoutException:
+            logging.info("Timeout waiting for redirection after login. Checking for alternative failure signs...")
+            # Try to handle immediate alerts first
+            try:
+                alert = driver.switch_to.alert
+                alert_text = alert.text
+                logging.error(f"Alert found after login attempt: {alert_text}")
+                alert.accept() # Accept the alert to dismiss it
+                session.update(f"Login failed: Alert - {alert_text}", -1)
+                return {"status": "error", "message": f"Login failed: {alert_text}"}
+            except NoAlertPresentException:
+                logging.info("No immediate alert found. Checking for error messages on the page.")
+            
+                error_message = None
+                try:
+                    # One short probe across all known error labels instead of a full timeout per id
+                    error_elements_ids = ["lblMsg", "ErrorMessage", "ctl00_ContentPlaceHolder1_lblMessage"]
+                    error_message = waits.probe_text(error_elements_ids)
+
+                    if error_message:
+                        logging.error(f"Found on-page error message: {error_message}")
+                        session.update(f"Login failed: On-page error - {error_message}", -1)
+                        return {"status": "error", "message": f"Login failed: {error_message}"}
+                    else:
+                        logging.warning("No specific error message element found on the page.")
+
+                except Exception as e:
+                    logging.error(f"Error checking for on-page error messages: {e}")
+
+                run_images.put(session.id, "login_failure", driver.get_screenshot_as_png())
+                logging.error(f"Login failed, no redirect and no immediate alert/error message. Screenshot kept for session {session.id}")
+                session.update(f"Login failed: No redirect or alert. See screenshot.", -1)
+                return {"status": "error", "message": "Login failed: Check screenshot for details."}
+    
+    # ✅ Click the 'Feedback' tab if login succeeded
+    feedback_link = waits.until(
+        "navigation", EC.element_to_be_clickable((By.XPATH, '//a[contains(@href, "SubjectTeacher.aspx") and contains(text(), "Feedback")]'))
+    )
+    feedback_link.click()
+    logging.info("Navigated to Feedback page.")
+    session.update("Successfully navigated to Feedback page.", 40)
+    
+    waits.until("navigation", EC.element_to_be_clickable((By.ID, "btnPhase1Feedback")))
+    logging.info("On SubjectTeacher.aspx. Starting Phase 1...")
+    session.update("On SubjectTeacher.aspx. Starting Phase 1...", 50)
+
+
+# Function to run the Selenium automation. Without credentials the run is a prefetch: it loads the
+# CAPTCHA straight away and waits for the credentials to be bound to the session
+def run_feedback_automation_task(session, username=None, password=None, engine=DEFAULT_ENGINE, rating=DEFAULT_RATING):
+    session.update("Starting automation...", 5)
+
+    driver = None
+
+    try:
+        session.raise_if_cancelled() # Cancelled while still queued
+        captcha_loaded = False
+        if username is None:
+            driver = acquire_driver(session)
+            session.raise_if_cancelled()
+            waits = WaitPolicy(driver)
+            load_captcha(session, driver, waits)
+            captcha_loaded = True
+            with session.trace.span("credentials_wait"):
+                credentials = session.wait_for_credentials(WARM_SESSION_TTL_SECONDS)
+            if credentials is None:
+                session.cancel("the prefetched session expired unused")
+            session.raise_if_cancelled()
+            username, password, engine, rating = credentials
+            logging.info("Credentials bound to prefetched session.")
+
+        user_key = login_cache.user_key(username, password)
+        checkpoint = RunCheckpoint(login_cache, user_key)
+        http = None
+        logged_in = False
+        saved = login_cache.cookies(user_key)
+        if saved and engine == "http":
+            # A saved login can be checked without a browser at all
+            with session.trace.span("login_reuse"):
+                http = reuse_http_login(saved)
+            logged_in = http is not None
+
+        if not logged_in:
+            if driver is None:
+                driver = acquire_driver(session)
+                session.raise_if_cancelled()
+                waits = WaitPolicy(driver) # Per-step budgets instead of one blanket timeout
+            if saved and engine == "selenium":
+                with session.trace.span("login_reuse", source=driver):
+                    logged_in = reuse_browser_login(driver, waits, saved)
+                captcha_loaded = False # The browser has left the login page either way
+
+        if logged_in:
+            cookies = saved[0]
+            logging.info("Reused saved portal login, skipping CAPTCHA and login.")
+            session.reset_captcha_events() # A prefetched CAPTCHA is no longer needed
+            run_images.delete(session.id, "captcha")
+            session.update("Reused saved portal login. Starting Phase 1...", 50)
+        else:
+            if saved:
+                logging.info("Saved portal login is no longer accepted, logging in again.")
+                login_cache.forget_login(user_key)
+            if not captcha_loaded:
+                load_captcha(session, driver, waits)
+            error = log_in(session, driver, waits, username, password)
+            if error:
+                return error
+            cookies = driver.get_cookies()
+            login_cache.store_login(user_key, cookies, driver.execute_script("return navigator.userAgent;"))
+
+        if engine == "http":
+            if http is None:
+                http = HttpFeedbackEngine.from_driver(driver, PORTAL_BASE_URL)
+            if driver is not None:
+                # Only the login needs a browser; its cookies are copied, so give Chrome back right away
+                driver_pool.release(driver)
+                session.driver = driver = None
+                logging.info("Released browser after login, continuing over HTTP.")
+            try:
+                run_http_phases(session, http, rating, checkpoint)
+            except (requests.RequestException, PortalError) as e:
+                # Fall back to the browser with the same login and pick up whatever is still pending
+                logging.warning(f"HTTP engine failed, falling back to Selenium: {e}")
+                session.update("Fast path unavailable, continuing in the browser...")
+                driver = acquire_driver(session)
+                waits = WaitPolicy(driver)
+                restore_cookies(driver, cookies)
+                driver.get(PORTAL_BASE_URL + "SubjectTeacher.aspx")
+                waits.until("navigation", EC.element_to_be_clickable((By.ID, "btnPhase1Feedback")))
+                run_selenium_phases(session, driver, waits, rating, checkpoint)
+        else:
+            run_selenium_phases(session, driver, waits, rating, checkpoint)
+
+        checkpoint.clear()
+        logging.info("Automation complete!")
+        session.update("Automation complete!", 100)
+        return {"status": "success", "message": "Feedback automation completed."}
+
+    except RunCancelled as e:
+        logging.info(f"Automation cancelled: {e}")
+        session.update(f"Automation cancelled: {e}.", -1)
+        return {"status": "cancelled", "message": f"Automation cancelled: {e}."}
+
+    except UnexpectedAlertPresentException as e:
+        alert_text = "Unknown Alert"
+        try:
+            alert = driver.switch_to.alert
+            alert_text = alert.text
+            alert.accept()
+        except Exception:
+            pass
+        logging.error(f"Caught an unexpected alert: {alert_text} - {e}")
+        session.update(f"Automation failed: Unexpected Alert - {alert_text}", -1)
+        return {"status": "error", "message": f"Automation failed: Unexpected Alert - {alert_text}"}
+
+    except Exception as e:
+        logging.exception("An unhandled error occurred during automation:") # Use exception for full traceback
+        session.update(f"Automation failed: {str(e)}", -1)
+        return {"status": "error", "message": str(e)}
+    finally:
+        if driver:
+            # Hand the browser back to the pool, which resets or recycles it
+            driver_pool.release(driver)
+            session.driver = None # Clear session reference
+            logging.info("Selenium WebDriver returned to pool.")
+        # Ensure the CAPTCHA is dropped even if automation fails at the end
+        run_images.delete(session.id, "captcha")
+        
+        # Ensure events are cleared in finally block in case of unexpected termination
+        session.reset_captcha_events()
+        logging.info("Automation events cleared.")
@@ -0,0 +1,216 @@
+import os
+import time
+import uuid
+import threading
+
+# "inline" runs automation on threads inside the web process (single process deployments).
+# "queue" hands runs to worker.py processes through the shared job store, so the web tier
+# can run any number of gunicorn workers without owning a browser. The workers must share the web tier's
+# disk, so queue mode is for single-host setups: start.sh (the container's entry point) runs it that way.
+# Inline stays the default for a bare `gunicorn app:app` and is what the Procfile uses
+RUN_BACKEND = os.environ.get("RUN_BACKEND", "inline")
+# How often a status stream re-reads the job store in queue mode
+STREAM_POLL_SECONDS = float(os.environ.get("STREAM_POLL_SECONDS", "0.5"))
+
+
+def empty_pool_totals():
+    return {"idle": 0, "in_use": 0, "limit": 0, "checkouts": 0, "hits": 0, "misses": 0, "wait_seconds_total": 0.0}
+
+
+class InlineBackend:
+    # Runs live in this process: SessionManager threads and the local browser pool
+
+    def __init__(self):
+        from sessions import SessionManager
+        from image_store import ImageStore
+        from preflight import Preflight
+        self.sessions = SessionManager()
+        self.images = ImageStore()
+        self.reaper = None
+        self._automation = None
+        self._automation_lock = threading.Lock()
+        self._prefetch_lock = threading.Lock()
+        # Selenium and the browser pool are loaded by the preflight thread, not at import, so the web
+        # process answers requests straight away and reports ready once a browser has started
+        self.preflight = Preflight(self._load_automation).start()
+
+    def _load_automation(self):
+        with self._automation_lock:
+            if self._automation is None:
+                import automation
+                from driver_pool import DRIVER_POOL_PREWARM
+                from reaper import Reaper
+                automation.run_images = self.images
+                if DRIVER_POOL_PREWARM:
+                    automation.driver_pool.start()
+                self.reaper = Reaper(self.sessions.live_sessions, automation.driver_pool).start()
+                self._automation = automation
+        return self._automation
+
+    def _run(self, session, *args):
+        # Runs on a SessionManager thread, so a run submitted before the preflight finished waits there, not in the request
+        return self._load_automation().run_feedback_automation_task(session, *args)
+
+    def start_run(self, username, password, engine, rating):
+        # Raises CapacityError when the worker pool and its queue are full
+        session = self.sessions.create_session()
+        self.sessions.submit(session, self._run, username, password, engine, rating)
+        return session.id
+
+    def prefetch(self, engine, rating):
+        # Starts a run without credentials so it reaches the CAPTCHA while the user is still typing.
+        # It takes a normal run slot, and warm sessions are capped so they cannot crowd out real runs
+        from sessions import CapacityError, warm_session_cap
+        with self._prefetch_lock:
+            if sum(1 for s in self.sessions.live_sessions() if s.warm) >= warm_session_cap(self.sessions.max_workers):
+                raise CapacityError("No browser free to prepare a session.")
+            session = self.sessions.create_session()
+            session.warm = True
+            self.sessions.submit(session, self._run, None, None, engine, rating)
+        return session.id
+
+    def bind_credentials(self, session_id, username, password, engine, rating):
+        # False if the session is unknown, not prefetched, already bound or gone
+        session = self.sessions.get(session_id)
+        return session is not None and session.bind_credentials(username, password, engine, rating)
+
+    def get_status(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        status = session.get_status()
+        status["finished"] = session.is_finished
+        return status
+
+    def submit_captcha(self, session_id, solution):
+        session = self.sessions.get(session_id)
+        if session is None or not session.captcha_ready_event.is_set():
+            return False
+        session.submit_captcha(solution)
+        return True
+
+    def cancel(self, session_id, reason):
+        # False if there is no such run or it already finished
+        session = self.sessions.get(session_id)
+        if session is None or session.is_finished:
+            return False
+        session.cancel(reason)
+        return True
+
+    def touch(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.touch()
+
+    def wait_for_change(self, session_id, seen_version, timeout):
+        # Returns (version, finished), or None once the session is gone
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        return session.wait_for_change(seen_version, timeout), session.is_finished
+
+    def get_trace(self, session_id):
+        session = self.sessions.get(session_id)
+        return session.trace.to_dict() if session else None
+
+    def counts(self):
+        counts = self.sessions.counts()
+        return {"active": counts["active"], "queued": counts["queued"], "capacity": self.sessions.max_workers}
+
+    def pool_stats(self):
+        return self._automation.driver_pool.stats() if self._automation else None
+
+    def pool_totals(self):
+        return self._automation.driver_pool.stats() if self._automation else empty_pool_totals()
+
+    def readiness(self):
+        return {"ready": self.preflight.ready, "preflight": self.preflight.to_dict()}
+
+    def remote_metrics(self):
+        # Runs execute in this process, so its own metrics already cover them
+        return {}
+
+
+class QueueBackend:
+    # Runs live in worker.py processes; everything goes through the SQLite job store
+
+    def __init__(self):
+        from job_store import JobStore
+        self.store = JobStore()
+        self.images = self.store.images
+
+    def start_run(self, username, password, engine, rating):
+        session_id = uuid.uuid4().hex
+        self.store.enqueue(session_id, username, password, engine, rating)
+        return session_id
+
+    def prefetch(self, engine, rating):
+        # Same cap as inline, against the run slots of every live worker
+        from sessions import warm_session_cap
+        session_id = uuid.uuid4().hex
+        self.store.enqueue(session_id, None, None, engine, rating, max_warm=warm_session_cap(self.counts()["capacity"]))
+        return session_id
+
+    def bind_credentials(self, session_id, username, password, engine, rating):
+        return self.store.bind_credentials(session_id, username, password, engine, rating)
+
+    def get_status(self, session_id):
+        return self.store.get_status(session_id)
+
+    def submit_captcha(self, session_id, solution):
+        status = self.store.get_status(session_id)
+        if status is None or not status["captcha_ready"]:
+            return False
+        return self.store.submit_captcha(session_id, solution)
+
+    def cancel(self, session_id, reason):
+        return self.store.cancel(session_id, reason)
+
+    def touch(self, session_id):
+        self.store.touch(session_id)
+
+    def wait_for_change(self, session_id, seen_version, timeout):
+        # No cross-process condition to wait on, so poll the store's version column
+        deadline = time.time() + timeout
+        while True:
+            current = self.store.get_version(session_id)
+            if current is None or current[0] != seen_version or time.time() >= deadline:
+                return current
+            time.sleep(STREAM_POLL_SECONDS)
+
+    def get_trace(self, session_id):
+        return self.store.get_trace(session_id)
+
+    def counts(self):
+        counts = self.store.counts()
+        capacity = sum(w.get("capacity", 0) for w in self.store.worker_stats().values())
+        return {"active": counts["running"], "queued": counts["queued"], "capacity": capacity}
+
+    def pool_stats(self):
+        # One entry per live worker process
+        return {worker_id: stats.get("pool") for worker_id, stats in self.store.worker_stats().items()}
+
+    def pool_totals(self):
+        # Browser pool figures summed over every live worker
+        totals = empty_pool_totals()
+        for pool in self.pool_stats().values():
+            for key in totals:
+                totals[key] += (pool or {}).get(key, 0)
+        return totals
+
+    def remote_metrics(self):
+        # Run and span metrics of every live worker, as published with its heartbeat
+        return {worker_id: stats.get("metrics", {}) for worker_id, stats in self.store.worker_stats().items()}
+
+    def readiness(self):
+        # Workers only report in once their own preflight has passed, so one live worker is enough
+        workers = len(self.store.worker_stats())
+        return {"ready": workers > 0, "workers": workers}
+
+
+def create_backend(name=RUN_BACKEND):
+    if name == "inline":
+        return InlineBackend()
+    if name == "queue":
+        return QueueBackend()
+    raise ValueError(f"Unknown RUN_BACKEND {name!r}, expected 'inline' or 'queue'.")
@@ -0,0 +1,233 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+from mock_portal import create_portal, MOCK_CAPTCHA_ANSWER
+
+try:
+    import psutil # Optional, only used to report browser memory
+except ImportError:
+    psutil = None
+
+# End-to-end benchmark against the offline mock portal. Needs Chrome/chromedriver like the app itself,
+# but no network. Reports time-to-CAPTCHA, per-feedback latency, run wall time and runs/minute,
+# plus browser RSS when psutil is installed.
+#
+#   python benchmark.py --runs 8 --concurrency 4 --items 5 --latency-ms 50 --engine http
+#   python benchmark.py --profile both   # lean vs standard browser profile, side by side
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100.0 * (len(ordered) - 1))))
+    return round(ordered[index], 3)
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(statistics.mean(values), 3),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "max": round(max(values), 3),
+    }
+
+
+def start_portal(args):
+    portal = create_portal(
+        items_per_phase=args.items,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        login_failure_rate=args.login_failure_rate,
+        submit_failure_rate=args.submit_failure_rate,
+        seed=args.seed,
+    )
+    server = make_server("127.0.0.1", 0, portal, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, portal, f"http://127.0.0.1:{server.server_port}/Students/"
+
+
+def solve_captcha(session, timeout):
+    # Stands in for the student: answers the CAPTCHA as soon as the run asks for it
+    if session.captcha_ready_event.wait(timeout):
+        session.submit_captcha(MOCK_CAPTCHA_ANSWER)
+
+
+def run_metrics(session):
+    spans = session.trace.to_dict()["spans"]
+    by_name = {}
+    for span in spans:
+        by_name.setdefault(span["name"], []).append(span)
+
+    queue_end = sum(s["offset"] + s["duration"] for s in by_name.get("queue_wait", [])[:1])
+    captcha = by_name.get("captcha_capture", [])[:1]
+    time_to_captcha = captcha[0]["offset"] + captcha[0]["duration"] - queue_end if captcha else None
+
+    # A feedback item is its fill span plus its submit span
+    per_item = {}
+    for name in ("feedback_fill", "feedback_submit"):
+        for span in by_name.get(name, []):
+            per_item[span["detail"]] = per_item.get(span["detail"], 0) + span["duration"]
+
+    return {
+        "status": session.get_status(),
+        "time_to_captcha": time_to_captcha,
+        "feedback_latencies": list(per_item.values()),
+        "wall_time": session.finished_at - session.trace.started_at - queue_end if session.finished_at else None,
+        "webdriver_calls": sum(s["webdriver_calls"] for s in spans),
+    }
+
+
+class RssSampler:
+    # Samples the summed RSS of the pool's browsers (chromedriver plus every Chrome child) while a benchmark runs
+
+    def __init__(self, pool, interval=0.5):
+        self.pool = pool
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if psutil is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if not self.samples:
+            return None
+        per_browser = [total / browsers for total, browsers in self.samples if browsers]
+        return {
+            "peak_total": round(max(total for total, _ in self.samples), 1),
+            "mean_per_browser": round(statistics.mean(per_browser), 1) if per_browser else None,
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            total, browsers = 0, 0
+            for pid in self.pool.browser_pids():
+                try:
+                    process = psutil.Process(pid)
+                    total += sum(p.memory_info().rss for p in [process] + process.children(recursive=True))
+                    browsers += 1
+                except psutil.Error:
+                    pass # Browser quit between listing and sampling
+            self.samples.append((total / 1024 / 1024, browsers))
+
+
+def run_benchmark(args, automation, portal, profile):
+    from driver_pool import DriverPool
+    from sessions import SessionManager
+    from login_cache import LoginCache
+
+    # Each profile gets its own pool; the automation looks the pool up on the module at call time
+    automation.driver_pool = DriverPool(size=args.concurrency, profile=profile)
+    # and an empty login cache, so no run skips the login on a login saved by an earlier run or profile
+    automation.login_cache = LoginCache()
+    portal_before = dict(portal.config["MOCK_STATS"])
+
+    pool_started = time.time()
+    automation.driver_pool.start()
+    while time.time() - pool_started < 60:
+        pool = automation.driver_pool.stats()
+        if pool["idle"] >= args.concurrency or pool["launch_failures"] >= args.concurrency:
+            break
+        time.sleep(0.1)
+    warmup_seconds = time.time() - pool_started
+
+    sampler = RssSampler(automation.driver_pool).start()
+    manager = SessionManager(max_workers=args.concurrency, max_queued=args.runs)
+    started = time.time()
+    runs = []
+    for i in range(args.runs):
+        session = manager.create_session()
+        # Own credentials per run: each logs in through the CAPTCHA and gets its own portal session and items
+        future = manager.submit(session, automation.run_feedback_automation_task, f"bench-{i}", "benchmark", args.engine)
+        threading.Thread(target=solve_captcha, args=(session, args.timeout), daemon=True).start()
+        runs.append((session, future))
+    for _, future in runs:
+        future.result(timeout=args.timeout)
+    elapsed = time.time() - started
+    rss = sampler.stop()
+
+    results = [run_metrics(session) for session, _ in runs]
+    succeeded = [r for r in results if r["status"]["progress"] == 100]
+    portal_after = portal.config["MOCK_STATS"]
+    report = {
+        "profile": profile,
+        "engine": args.engine,
+        "runs": args.runs,
+        "concurrency": args.concurrency,
+        "items_per_phase": args.items,
+        "latency_ms": args.latency_ms,
+        "pool_warmup_seconds": round(warmup_seconds, 3),
+        "succeeded": len(succeeded),
+        "failed": len(results) - len(succeeded),
+        "elapsed_seconds": round(elapsed, 3),
+        "runs_per_minute": round(len(succeeded) / elapsed * 60, 2) if elapsed else None,
+        "time_to_captcha_seconds": summarize([r["time_to_captcha"] for r in results if r["time_to_captcha"] is not None]),
+        "feedback_latency_seconds": summarize([v for r in results for v in r["feedback_latencies"]]),
+        "run_wall_seconds": summarize([r["wall_time"] for r in succeeded if r["wall_time"] is not None]),
+        "webdriver_calls_per_run": summarize([r["webdriver_calls"] for r in results]),
+        "browser_rss_mb": rss,
+        "portal": {key: portal_after[key] - portal_before.get(key, 0) for key in portal_after},
+        "pool": automation.driver_pool.stats(),
+        "errors": [r["status"]["message"] for r in results if r["status"]["progress"] != 100],
+    }
+    automation.driver_pool.shutdown()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the feedback automation against the offline mock portal.")
+    parser.add_argument("--runs", type=int, default=4, help="Total automation runs")
+    parser.add_argument("--concurrency", type=int, default=2, help="Concurrent sessions (worker pool and browser pool size)")
+    parser.add_argument("--engine", choices=("http", "selenium"), default="http")
+    parser.add_argument("--profile", choices=("lean", "standard", "both"), default="lean", help="Browser profile; 'both' runs each in turn")
+    parser.add_argument("--items", type=int, default=5, help="Pending feedback items per phase")
+    parser.add_argument("--latency-ms", type=int, default=0)
+    parser.add_argument("--jitter-ms", type=int, default=0)
+    parser.add_argument("--login-failure-rate", type=float, default=0.0)
+    parser.add_argument("--submit-failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for each run")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    server, portal, base_url = start_portal(args)
+
+    # The automation reads its settings at import time, so point it at the mock first
+    os.environ["PORTAL_BASE_URL"] = base_url
+    os.environ["DRIVER_POOL_SIZE"] = str(args.concurrency)
+    import automation
+
+    profiles = ("lean", "standard") if args.profile == "both" else (args.profile,)
+    reports = [run_benchmark(args, automation, portal, profile) for profile in profiles]
+    report = reports[0] if len(reports) == 1 else {"profiles": {r["profile"]: r for r in reports}}
+
+    server.shutdown()
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == '__main__':
+    main()
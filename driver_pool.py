@@ -0,0 +1,312 @@
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+import os
+import threading
+import time
+import queue
+import logging
+
+from sessions import MAX_CONCURRENT_RUNS
+
+# Number of headless browsers kept warm (and the most the pool will ever hold)
+DRIVER_POOL_SIZE = int(os.environ.get("DRIVER_POOL_SIZE", str(MAX_CONCURRENT_RUNS)))
+# A browser is retired after this many runs or this many seconds, whichever comes first
+DRIVER_MAX_USES = int(os.environ.get("DRIVER_MAX_USES", "20"))
+DRIVER_MAX_AGE_SECONDS = int(os.environ.get("DRIVER_MAX_AGE_SECONDS", "1800"))
+# Set to 0 to skip launching browsers when the app starts
+DRIVER_POOL_PREWARM = os.environ.get("DRIVER_POOL_PREWARM", "1") == "1"
+
+# Browser and driver binaries (the Docker image sets both). When unset Selenium Manager looks them up,
+# which can mean a download on first launch
+CHROME_BIN = os.environ.get("CHROME_BIN")
+CHROMEDRIVER_PATH = os.environ.get("CHROMEDRIVER_PATH")
+
+# Put in the environment of every chromedriver (and so every Chrome) the pool launches; the reaper only
+# ever kills processes that carry it
+BROWSER_MARKER = "FEEDBACK_AUTOMATION_BROWSER"
+
+# "lean" blocks heavy resources and returns from navigation at DOMContentLoaded; "standard" is a stock headless Chrome
+BROWSER_PROFILES = ("lean", "standard")
+BROWSER_PROFILE = os.environ.get("BROWSER_PROFILE", "lean")
+# JS heap cap (MB) for renderers in the lean profile
+BROWSER_LEAN_HEAP_MB = int(os.environ.get("BROWSER_LEAN_HEAP_MB", "128"))
+# URL patterns the lean profile never fetches: stylesheets, static images, fonts, media and trackers.
+# Patterns match the whole URL, so the CAPTCHA (served by an .aspx handler with a query string) is never caught
+# by the extension patterns; see unblock_resources for when it is served some other way.
+# Override with a comma-separated BROWSER_BLOCKED_URLS
+DEFAULT_BLOCKED_URLS = (
+    "*.css", "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot", "*.mp4", "*.webm", "*.mp3",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*facebook.net*",
+)
+BROWSER_BLOCKED_URLS = [p.strip() for p in os.environ.get("BROWSER_BLOCKED_URLS", ",".join(DEFAULT_BLOCKED_URLS)).split(",") if p.strip()]
+
+
+def build_chrome_options(profile=BROWSER_PROFILE):
+    chrome_options = Options()
+    if CHROME_BIN:
+        chrome_options.binary_location = CHROME_BIN
+    chrome_options.add_argument("--headless") # Keep headless for Render deployment
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36")
+    if profile == "lean":
+        # driver.get returns at DOMContentLoaded; the steps that need more (the CAPTCHA image) wait for it explicitly
+        chrome_options.page_load_strategy = "eager"
+        chrome_options.add_argument("--disable-extensions")
+        chrome_options.add_argument("--disable-gpu")
+        chrome_options.add_argument("--disable-background-networking")
+        chrome_options.add_argument("--disable-component-update")
+        chrome_options.add_argument("--disable-default-apps")
+        chrome_options.add_argument("--disable-sync")
+        chrome_options.add_argument("--mute-audio")
+        chrome_options.add_argument("--no-first-run")
+        chrome_options.add_argument("--disable-features=Translate,OptimizationHints,MediaRouter")
+        chrome_options.add_argument(f"--js-flags=--max-old-space-size={BROWSER_LEAN_HEAP_MB}")
+        chrome_options.add_argument("--renderer-process-limit=2")
+    return chrome_options
+
+
+def block_resources(driver):
+    # Network.setBlockedURLs stays in force across navigations for the browser's lifetime
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BROWSER_BLOCKED_URLS})
+
+
+def unblock_resources(driver):
+    # Lets everything through again for the rest of the run (the pool re-applies blocking on release)
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": []})
+
+
+def count_round_trips(driver):
+    # Every WebDriver command (driver or element) goes through driver.execute, so counting there
+    # gives the number of round trips to chromedriver
+    driver.round_trips = 0
+    execute = driver.execute
+
+    def counted_execute(driver_command, params=None):
+        driver.round_trips += 1
+        return execute(driver_command, params)
+
+    driver.execute = counted_execute
+    return driver
+
+
+def launch_driver(profile=BROWSER_PROFILE):
+    service = Service(executable_path=CHROMEDRIVER_PATH, env=dict(os.environ, **{BROWSER_MARKER: "1"}))
+    driver = webdriver.Chrome(options=build_chrome_options(profile), service=service)
+    driver.browser_profile = profile
+    if profile == "lean":
+        block_resources(driver)
+    return count_round_trips(driver)
+
+
+class DriverPool:
+    # Keeps a few headless browsers running so a run only pays for loading the page, not launching Chrome
+
+    def __init__(self, size=DRIVER_POOL_SIZE, max_uses=DRIVER_MAX_USES, max_age=DRIVER_MAX_AGE_SECONDS, profile=BROWSER_PROFILE, factory=None):
+        if profile not in BROWSER_PROFILES:
+            raise ValueError(f"Unknown browser profile {profile!r}, expected one of {BROWSER_PROFILES}.")
+        self.size = size
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.profile = profile
+        # Live browser ceiling set from available memory (see reaper.py); never above size
+        self.limit = size
+        self._factory = factory or (lambda: launch_driver(profile))
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        # driver -> {"created_at": ..., "uses": ...} for every browser the pool owns
+        self._drivers = {}
+        self._launching = 0
+        self._closed = False
+        self._prewarmed = False
+        self._stats = {"checkouts": 0, "hits": 0, "misses": 0, "recycled": 0, "launch_failures": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+
+    def start(self):
+        # Pre-launch the warm browsers in the background so app startup is not blocked
+        self._prewarmed = True
+        for _ in range(self.limit):
+            self._launch_async()
+
+    def acquire(self, timeout=120, check=None):
+        # With timeout=None, waits until a browser frees up. check, if given, is called about once a second
+        # while waiting and may raise to give up
+        started = time.time()
+        hit = True
+        try:
+            driver = self._idle.get_nowait()
+        except queue.Empty:
+            driver = None
+
+        while driver is None:
+            hit = False
+            if self._reserve_launch_slot():
+                driver = self._launch()
+                break
+            # Every browser is busy, still starting or over the memory limit; wait for one to come back,
+            # re-checking now and then in case the limit was raised
+            remaining = 1 if timeout is None else started + timeout - time.time()
+            if remaining <= 0:
+                raise TimeoutError(f"No browser became available within {timeout} seconds.")
+            try:
+                driver = self._idle.get(timeout=min(remaining, 1))
+            except queue.Empty:
+                pass
+            if driver is None and check is not None:
+                check()
+
+        waited = time.time() - started
+        with self._lock:
+            self._drivers[driver]["uses"] += 1
+            self._stats["checkouts"] += 1
+            self._stats["hits" if hit else "misses"] += 1
+            self._stats["wait_seconds_total"] += waited
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+        logging.info(f"Checked out browser from pool ({'warm' if hit else 'cold'}, waited {waited:.2f}s).")
+        return driver
+
+    def release(self, driver):
+        with self._lock:
+            meta = self._drivers.get(driver)
+        if meta is None:
+            return
+
+        expired = meta["uses"] >= self.max_uses or time.time() - meta["created_at"] >= self.max_age
+        if self._closed or expired:
+            logging.info(f"Recycling browser after {meta['uses']} uses.")
+            self._discard(driver, recycled=True)
+            return
+        with self._lock:
+            over_limit = len(self._drivers) > self.limit
+        if over_limit:
+            logging.info("Closing browser to get back under the live browser limit.")
+            self._discard(driver, replace=False)
+            return
+
+        try:
+            self._reset(driver)
+        except Exception as e:
+            logging.warning(f"Could not reset browser, replacing it: {e}")
+            self._discard(driver, recycled=True)
+            return
+        self._idle.put(driver)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["total"] = len(self._drivers)
+            stats["launching"] = self._launching
+            stats["limit"] = self.limit
+        stats["profile"] = self.profile
+        stats["idle"] = self._idle.qsize()
+        stats["in_use"] = stats["total"] - stats["idle"]
+        checkouts = stats["checkouts"]
+        stats["hit_ratio"] = round(stats["hits"] / checkouts, 3) if checkouts else None
+        stats["wait_seconds_avg"] = round(stats["wait_seconds_total"] / checkouts, 3) if checkouts else None
+        return stats
+
+    def set_limit(self, limit):
+        # Caps live browsers below size; idle ones over the new limit are closed now, busy ones when released
+        limit = max(1, min(self.size, limit))
+        with self._lock:
+            changed = limit != self.limit
+            self.limit = limit
+        if not changed:
+            return
+        logging.info(f"Live browser limit set to {limit}.")
+        while True:
+            with self._lock:
+                excess = len(self._drivers) > self.limit
+            if not excess:
+                break
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver, replace=False)
+        if self._prewarmed:
+            for _ in range(self.limit):
+                self._launch_async() # Refill warm browsers if the limit went up; no-op once full
+
+    def browser_pids(self):
+        # chromedriver pid of every browser the pool owns; Chrome's own processes are its children
+        with self._lock:
+            drivers = list(self._drivers)
+        processes = [getattr(getattr(d, "service", None), "process", None) for d in drivers]
+        return [process.pid for process in processes if process is not None]
+
+    def shutdown(self):
+        self._closed = True
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver, replace=False)
+
+    def _reset(self, driver):
+        # Leave the browser as if freshly launched: one tab, no cookies, no storage, blank page
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+        try:
+            driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+        except Exception:
+            pass # about:blank and some error pages have no storage
+        # delete_all_cookies only covers the current domain, CDP clears every origin
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        if getattr(driver, "browser_profile", None) == "lean":
+            block_resources(driver) # The run may have lifted it for the CAPTCHA
+        driver.get("about:blank")
+
+    def _reserve_launch_slot(self):
+        with self._lock:
+            if self._closed or len(self._drivers) + self._launching >= self.limit:
+                return False
+            self._launching += 1
+            return True
+
+    def _launch(self):
+        # The caller must hold a launch slot from _reserve_launch_slot
+        try:
+            driver = self._factory()
+        except Exception:
+            with self._lock:
+                self._launching -= 1
+                self._stats["launch_failures"] += 1
+            raise
+        with self._lock:
+            self._launching -= 1
+            self._drivers[driver] = {"created_at": time.time(), "uses": 0}
+        return driver
+
+    def _launch_async(self):
+        if not self._reserve_launch_slot():
+            return
+
+        def warm():
+            try:
+                driver = self._launch()
+            except Exception as e:
+                logging.warning(f"Could not pre-launch browser for pool: {e}")
+                return
+            self._idle.put(driver)
+            logging.info("Pre-launched browser added to pool.")
+
+        threading.Thread(target=warm, daemon=True).start()
+
+    def _discard(self, driver, recycled=False, replace=True):
+        with self._lock:
+            self._drivers.pop(driver, None)
+            if recycled:
+                self._stats["recycled"] += 1
+        try:
+            driver.quit()
+        except Exception as e:
+            logging.warning(f"Error quitting browser: {e}")
+        if replace and not self._closed:
+            self._launch_async()
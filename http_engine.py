@@ -0,0 +1,225 @@
+import os
+import re
+import logging
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
+
+# Seconds to wait for any single portal request
+HTTP_TIMEOUT_SECONDS = float(os.environ.get("HTTP_TIMEOUT_SECONDS", "30"))
+
+# One connection pool shared by every run, so keep-alive connections to the portal are reused
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+
+# Matches rating radio ids such as rdQ7_4 (question 7, option 4)
+_RATING_ID_RE = re.compile(r"^rdQ(\d+)_\w+$")
+
+# Matches __doPostBack('gvCustomers','Select$1') in onclick/href attributes
+_POSTBACK_RE = re.compile(r"__doPostBack\(\s*'([^']*)'\s*,\s*'([^']*)'\s*\)")
+
+
+class PortalError(Exception):
+    # Raised when the portal answers with a page we did not expect
+    pass
+
+
+class AspNetPage:
+    # A fetched portal page plus the bits needed to replay its postbacks
+
+    def __init__(self, response):
+        self.url = response.url
+        self.soup = BeautifulSoup(response.text, "html.parser")
+
+    def find(self, element_id):
+        return self.soup.find(id=element_id)
+
+    def form_action(self):
+        form = self.soup.find("form")
+        action = form.get("action") if form else None
+        return urljoin(self.url, action) if action else self.url
+
+    def form_fields(self):
+        # What a browser would post: hidden state, text inputs and checked radios/checkboxes, but no buttons
+        fields = {}
+        form = self.soup.find("form") or self.soup
+        for field in form.find_all("input"):
+            name = field.get("name")
+            kind = (field.get("type") or "text").lower()
+            if not name or kind in ("submit", "button", "image", "reset"):
+                continue
+            if kind in ("radio", "checkbox") and not field.has_attr("checked"):
+                continue
+            fields[name] = field.get("value", "on" if kind in ("radio", "checkbox") else "")
+        for select in form.find_all("select"):
+            option = select.find("option", selected=True) or select.find("option")
+            if select.get("name") and option is not None:
+                fields[select["name"]] = option.get("value", option.get_text())
+        fields["__EVENTTARGET"] = ""
+        fields["__EVENTARGUMENT"] = ""
+        return fields
+
+
+class HttpFeedbackEngine:
+    # Submits pending feedback with plain ASP.NET postbacks, reusing the cookies of a browser login
+
+    def __init__(self, base_url, cookies, user_agent=None):
+        self.base_url = base_url
+        # Number of HTTP requests sent, the HTTP engine's equivalent of WebDriver round trips
+        self.round_trips = 0
+        self.http = requests.Session()
+        self.http.mount("https://", _adapter)
+        self.http.mount("http://", _adapter)
+        if user_agent:
+            self.http.headers["User-Agent"] = user_agent
+        for cookie in cookies:
+            self.http.cookies.set(cookie["name"], cookie["value"], domain=cookie.get("domain"), path=cookie.get("path", "/"))
+
+    @classmethod
+    def from_driver(cls, driver, base_url):
+        user_agent = driver.execute_script("return navigator.userAgent;")
+        return cls(base_url, driver.get_cookies(), user_agent)
+
+    def get(self, url):
+        self.round_trips += 1
+        response = self.http.get(urljoin(self.base_url, url), timeout=HTTP_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return AspNetPage(response)
+
+    def post(self, page, extra_fields):
+        fields = page.form_fields()
+        fields.update(extra_fields)
+        self.round_trips += 1
+        response = self.http.post(page.form_action(), data=fields, timeout=HTTP_TIMEOUT_SECONDS, headers={"Referer": page.url})
+        response.raise_for_status()
+        return AspNetPage(response)
+
+    def click_button(self, page, button_id):
+        button = page.find(button_id)
+        if button is None or not button.get("name"):
+            raise PortalError(f"Button {button_id} not found on {page.url}")
+        return self.post(page, {button["name"]: button.get("value", "")})
+
+    def read_grid(self, page):
+        # Returns one record per data row of #gvCustomers: its position, status text and how to open it
+        table = page.find("gvCustomers")
+        if table is None:
+            raise PortalError(f"Feedback grid not found on {page.url}")
+        records = []
+        for index, row in enumerate(table.find_all("tr")):
+            cells = row.find_all("td")
+            if len(cells) <= 3:
+                continue # Header row or malformed row
+            records.append({
+                "index": index,
+                "key": " | ".join(cell.get_text(strip=True) for cell in cells[:3]),
+                "status": cells[3].get_text(strip=True),
+                "target": self._row_target(row),
+            })
+        return records
+
+    def open_row(self, page, record):
+        target = record["target"]
+        if target is None:
+            raise PortalError(f"Don't know how to open grid row {record['index']}")
+        if target[0] == "postback":
+            return self.post(page, {"__EVENTTARGET": target[1], "__EVENTARGUMENT": target[2]})
+        return self.get(urljoin(page.url, target[1]))
+
+    def submit_feedback(self, page, rating):
+        # Same rules as the in-browser filler: every rdQ{n}_* question gets option {rating}
+        questions = sorted({int(m.group(1)) for m in (_RATING_ID_RE.match(r.get("id", "")) for r in page.soup.find_all("input", type="radio")) if m})
+        if not questions:
+            raise PortalError(f"No rating questions found on {page.url}")
+        fields = {}
+        missing = []
+        for question in questions:
+            radio = page.find(f"rdQ{question}_{rating}")
+            if radio is None or not radio.get("name") or radio.has_attr("disabled"):
+                missing.append(question)
+                continue
+            fields[radio["name"]] = radio.get("value", radio["id"])
+        if missing:
+            logging.warning(f"Could not set rating {rating} for questions {missing}. Skipping them.")
+
+        submit_btn = page.find("btn_submit")
+        if submit_btn is None:
+            raise PortalError(f"Submit button not found on {page.url}")
+        fields[submit_btn["name"]] = submit_btn.get("value", "")
+        return self.post(page, fields)
+
+    def handle_phase(self, feedback_button_id, phase_name, session, rating, checkpoint=None):
+        with session.trace.span("phase", phase_name, self):
+            self._handle_phase(feedback_button_id, phase_name, session, rating, checkpoint)
+
+    def _handle_phase(self, feedback_button_id, phase_name, session, rating, checkpoint):
+        round_trips_at_start = self.round_trips
+        submitted = 0
+        # One entry per submission; each is also published on the session as it happens
+        items = []
+        page = self.get("SubjectTeacher.aspx")
+        page = self.click_button(page, feedback_button_id)
+        # Rows an earlier run already submitted count as one attempt, so they get one retry at most.
+        # A row whose two submissions both fail stops the run: with a per-submission failure rate p, a
+        # phase of n rows gets through with probability (1 - p*p)**n (about 0.58 for p=0.3 and n=6)
+        attempts = {key: 1 for key in checkpoint.submitted_rows(phase_name)} if checkpoint else {}
+
+        while True:
+            pending = [r for r in self.read_grid(page) if r["status"] == "Pending"]
+            if not pending:
+                round_trips = self.round_trips - round_trips_at_start
+                logging.info(f"No more pending feedbacks in {phase_name}. Submitted {submitted} in {round_trips} HTTP requests.")
+                session.add_phase_report({"phase": phase_name, "engine": "http", "submitted": submitted, "round_trips": round_trips, "items": items})
+                if checkpoint:
+                    checkpoint.phase_done(phase_name)
+                return
+
+            # The portal keeps the open phase in the login's session, so every row of this scan can be
+            # opened straight from the same grid page instead of going back to the list after each one.
+            # Bottom-up, so a portal that drops submitted rows cannot shift the rows still to come.
+            # A fresh scan afterwards retries whatever did not stick
+            done_page = None
+            for record in reversed(pending):
+                session.raise_if_cancelled()
+                attempts[record["key"]] = attempts.get(record["key"], 0) + 1
+                if attempts[record["key"]] > 2:
+                    raise PortalError(f"Feedback for '{record['key']}' in {phase_name} is still pending after submitting it twice.")
+
+                logging.info(f"Found pending item in {phase_name}, opening row {record['index']} over HTTP...")
+                session.update(f"Processing pending item in {phase_name}...", min(90, session.progress + 2))
+                detail = f"{phase_name}: {record['key']}"
+                with session.trace.span("feedback_fill", detail, self):
+                    form_page = self.open_row(page, record)
+                if "FeedBack.aspx" not in form_page.url:
+                    # The grid page went stale; rescan and retry the row
+                    logging.warning(f"Expected FeedBack.aspx after opening row, got {form_page.url}. Rescanning {phase_name}.")
+                    break
+
+                with session.trace.span("feedback_submit", detail, self):
+                    done_page = self.submit_feedback(form_page, rating)
+                    submitted += 1
+                    if checkpoint:
+                        checkpoint.row_submitted(phase_name, record["key"])
+                    item = {"phase": phase_name, "row": record["key"], "attempt": attempts[record["key"]]}
+                    items.append(item)
+                    session.add_report_item(item)
+                    logging.info("Submitted feedback over HTTP.")
+                    session.update(f"Feedback submitted for {record['key']} ({submitted} in {phase_name}).", min(90, session.progress + 5))
+
+            # Follow the same path a browser would: back to the list, then re-open the phase
+            back_link = done_page.find("HyperLink1") if done_page is not None else None
+            back_url = urljoin(done_page.url, back_link["href"]) if back_link is not None and back_link.get("href") else "SubjectTeacher.aspx"
+            page = self.click_button(self.get(back_url), feedback_button_id)
+
+    def _row_target(self, row):
+        candidates = [row] + row.find_all("a")
+        for element in candidates:
+            for attr in ("onclick", "href"):
+                match = _POSTBACK_RE.search(element.get(attr) or "")
+                if match:
+                    return ("postback", match.group(1), match.group(2))
+        link = row.find("a", href=True)
+        if link is not None and not link["href"].startswith("javascript:"):
+            return ("link", link["href"])
+        return None
@@ -0,0 +1,50 @@
+import os
+import threading
+import time
+import hashlib
+from collections import OrderedDict
+
+# Images older than this are dropped even if nobody deleted them
+IMAGE_STORE_TTL_SECONDS = int(os.environ.get("IMAGE_STORE_TTL_SECONDS", "600"))
+# Upper bound on stored images; the least recently stored ones go first
+IMAGE_STORE_MAX_ITEMS = int(os.environ.get("IMAGE_STORE_MAX_ITEMS", "256"))
+
+
+class ImageStore:
+    # Keeps per-run PNGs (CAPTCHA, failure screenshot) in memory instead of on disk
+
+    def __init__(self, ttl=IMAGE_STORE_TTL_SECONDS, max_items=IMAGE_STORE_MAX_ITEMS):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        # (session_id, kind) -> (png bytes, etag, stored_at)
+        self._images = OrderedDict()
+
+    def put(self, session_id, kind, png):
+        etag = hashlib.sha256(png).hexdigest()[:32]
+        key = (session_id, kind)
+        with self._lock:
+            self._images.pop(key, None)
+            self._images[key] = (png, etag, time.time())
+            self._evict()
+        return etag
+
+    def get(self, session_id, kind):
+        # Returns (png bytes, etag) or None
+        with self._lock:
+            self._evict()
+            entry = self._images.get((session_id, kind))
+        return entry[:2] if entry else None
+
+    def delete(self, session_id, kind):
+        with self._lock:
+            self._images.pop((session_id, kind), None)
+
+    def _evict(self):
+        # Caller must hold the lock. Entries are in insertion order, so expired ones are at the front
+        cutoff = time.time() - self.ttl
+        while self._images:
+            key, (_, _, stored_at) = next(iter(self._images.items()))
+            if stored_at >= cutoff and len(self._images) <= self.max_items:
+                break
+            del self._images[key]
@@ -0,0 +1,399 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+
+from cryptography.fernet import Fernet
+
+from login_cache import LoginCache, LOGIN_CACHE_TTL_SECONDS, LOGIN_CACHE_MAX_ITEMS
+from sessions import MAX_CONCURRENT_RUNS, MAX_QUEUED_RUNS, SESSION_RETENTION_SECONDS, CapacityError, warm_session_cap
+
+# SQLite file shared by the web tier and the worker processes (they must run on the same host or volume)
+JOB_STORE_PATH = os.environ.get("JOB_STORE_PATH", "automation_jobs.sqlite3")
+# Fernet key used to encrypt queued credentials and saved logins. Without one, a key file is created next to the database
+JOB_STORE_KEY = os.environ.get("JOB_STORE_KEY")
+# A worker that has not checked in for this long is considered dead and its runs are re-queued
+WORKER_STALE_SECONDS = int(os.environ.get("WORKER_STALE_SECONDS", "30"))
+# How many times a run may be started before it is failed instead of re-queued
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "2"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,              -- queued, running, finished
+    credentials BLOB,                 -- encrypted, dropped once the run finishes; NULL while a prefetched run waits for them
+    engine TEXT NOT NULL,
+    rating TEXT NOT NULL,
+    worker_id TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    version INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,             -- JSON status as returned by /status
+    trace TEXT,                       -- JSON run trace
+    captcha_solution TEXT,
+    last_seen_at REAL,                -- last time a client asked about the run
+    cancel_reason TEXT                -- set by /cancel, acted on by the worker running the job
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at);
+CREATE TABLE IF NOT EXISTS images (
+    session_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    png BLOB NOT NULL,
+    etag TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    PRIMARY KEY (session_id, kind)
+);
+CREATE TABLE IF NOT EXISTS logins (
+    user_key TEXT PRIMARY KEY,        -- HMAC of the credentials, see LoginCache.user_key
+    token BLOB NOT NULL,              -- Fernet token of the saved cookies and checkpoint
+    saved_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    heartbeat_at REAL NOT NULL,
+    stats TEXT NOT NULL
+);
+"""
+
+# Columns added after the first release of the schema, created on open for existing databases
+MIGRATIONS = {
+    "jobs": (("last_seen_at", "REAL"), ("cancel_reason", "TEXT")),
+}
+
+
+def _load_key(path, key):
+    if key:
+        return key.encode()
+    key_path = path + ".key"
+    if not os.path.exists(key_path):
+        # Several processes may boot at once: each writes a complete key to its own file and tries to link
+        # it into place. Linking fails if another process got there first, and the file is then read, so
+        # nobody ever sees a half-written key
+        tmp_path = f"{key_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(Fernet.generate_key())
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(tmp_path, key_path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+    with open(key_path, "rb") as f:
+        return f.read().strip()
+
+
+class JobStore:
+    # Durable run queue plus everything the web tier and workers exchange about a run:
+    # status, trace, CAPTCHA answer and images. Safe to use from many threads and processes
+
+    def __init__(self, path=JOB_STORE_PATH, key=JOB_STORE_KEY):
+        self.path = path
+        self.key = _load_key(path, key)
+        self._fernet = Fernet(self.key)
+        self._local = threading.local()
+        self.images = StoredImages(self)
+        self.logins = StoredLogins(self)
+        db = self._connect()
+        db.executescript(SCHEMA)
+        for table, columns in MIGRATIONS.items():
+            existing = {row["name"] for row in db.execute(f"PRAGMA table_info({table})")}
+            for name, kind in columns:
+                if name not in existing:
+                    db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind}")
+
+    def _connect(self):
+        # One connection per thread; WAL lets readers (the web tier) run alongside the workers' writes
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    # --- Web tier ---
+
+    def enqueue(self, job_id, username, password, engine, rating, max_queued=MAX_QUEUED_RUNS, max_warm=warm_session_cap(MAX_CONCURRENT_RUNS)):
+        # Without a username the job is a prefetch: it runs up to the CAPTCHA and waits for bind_credentials
+        warm = username is None
+        credentials = None if warm else self._encrypt_credentials(username, password)
+        status = {"message": "Queued, waiting for a free browser slot...", "progress": 0, "captcha_ready": False, "warm": warm, "report": {"phases": [], "items": []}}
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            queued = db.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+            if queued >= max_queued:
+                raise CapacityError("Server is at capacity. Please try again in a minute.")
+            if warm and db.execute("SELECT COUNT(*) FROM jobs WHERE state != 'finished' AND credentials IS NULL").fetchone()[0] >= max_warm:
+                raise CapacityError("No browser free to prepare a session.")
+            db.execute(
+                "INSERT INTO jobs (id, state, credentials, engine, rating, created_at, last_seen_at, status) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, credentials, engine, rating, time.time(), time.time(), json.dumps(status)),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def bind_credentials(self, job_id, username, password, engine, rating):
+        # Gives a prefetched job its credentials; False if it is unknown, finished or already has some
+        cursor = self._connect().execute(
+            "UPDATE jobs SET credentials = ?, engine = ?, rating = ? WHERE id = ? AND state != 'finished' AND credentials IS NULL",
+            (self._encrypt_credentials(username, password), engine, rating, job_id),
+        )
+        return cursor.rowcount == 1
+
+    def get_status(self, job_id):
+        # Same shape as AutomationSession.get_status, or None for unknown runs
+        row = self._connect().execute("SELECT status, version, state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        status = json.loads(row["status"])
+        status["version"] = row["version"]
+        status["session_id"] = job_id
+        status["finished"] = row["state"] == "finished"
+        return status
+
+    def get_version(self, job_id):
+        # Returns (version, finished) or None; cheap enough to poll
+        row = self._connect().execute("SELECT version, state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return (row["version"], row["state"] == "finished") if row else None
+
+    def get_trace(self, job_id):
+        row = self._connect().execute("SELECT trace, created_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row["trace"]) if row["trace"] else {"started_at": row["created_at"], "spans": []}
+
+    def submit_captcha(self, job_id, solution):
+        # Picked up by the worker running the job on its next poll
+        cursor = self._connect().execute(
+            "UPDATE jobs SET captcha_solution = ? WHERE id = ? AND state = 'running'", (solution, job_id)
+        )
+        return cursor.rowcount == 1
+
+    def touch(self, job_id):
+        self._connect().execute("UPDATE jobs SET last_seen_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def cancel(self, job_id, reason):
+        # A queued run is finished on the spot; a running one is flagged for its worker. False if already finished
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT state, status, version FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row["state"] == "finished":
+                db.execute("COMMIT")
+                return False
+            if row["state"] == "queued":
+                status = json.loads(row["status"])
+                status.update(message=f"Automation cancelled: {reason}.", progress=-1, captcha_ready=False)
+                db.execute("UPDATE jobs SET state = 'finished', finished_at = ?, credentials = NULL, status = ?, version = ? WHERE id = ?",
+                           (time.time(), json.dumps(status), row["version"] + 1, job_id))
+            else:
+                db.execute("UPDATE jobs SET cancel_reason = ? WHERE id = ?", (reason, job_id))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return True
+
+    def counts(self):
+        rows = self._connect().execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state").fetchall()
+        counts = {"queued": 0, "running": 0, "finished": 0}
+        counts.update({row["state"]: row["n"] for row in rows})
+        return counts
+
+    def worker_stats(self):
+        # Latest stats of every live worker
+        cutoff = time.time() - WORKER_STALE_SECONDS
+        rows = self._connect().execute("SELECT id, heartbeat_at, stats FROM workers WHERE heartbeat_at >= ?", (cutoff,)).fetchall()
+        return {row["id"]: dict(json.loads(row["stats"]), heartbeat_at=row["heartbeat_at"]) for row in rows}
+
+    # --- Workers ---
+
+    def claim(self, worker_id):
+        # Atomically takes the oldest queued job. Returns the job with its decrypted credentials, or None
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT id, credentials, engine, rating, created_at, version FROM jobs WHERE state = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            db.execute(
+                "UPDATE jobs SET state = 'running', worker_id = ?, started_at = ?, attempts = attempts + 1, captcha_solution = NULL WHERE id = ?",
+                (worker_id, time.time(), row["id"]),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        job = dict(row)
+        job.update(self._decrypt_credentials(job.pop("credentials")))
+        return job
+
+    def credentials(self, job_id):
+        # (username, password, engine, rating) once bound, for prefetched jobs already running
+        row = self._connect().execute("SELECT credentials, engine, rating FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["credentials"] is None:
+            return None
+        credentials = self._decrypt_credentials(row["credentials"])
+        return credentials["username"], credentials["password"], row["engine"], row["rating"]
+
+    def save_status(self, job_id, status, version, trace):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, version = ?, trace = ? WHERE id = ?",
+            (json.dumps(status), version, json.dumps(trace), job_id),
+        )
+
+    def run_signals(self, job_ids):
+        # What the web tier has recorded about running jobs: {job_id: {"last_seen_at", "cancel_reason", "bound"}}
+        if not job_ids:
+            return {}
+        marks = ",".join("?" * len(job_ids))
+        rows = self._connect().execute(
+            f"SELECT id, last_seen_at, cancel_reason, credentials IS NOT NULL AS bound FROM jobs WHERE id IN ({marks})", list(job_ids)
+        ).fetchall()
+        return {row["id"]: {"last_seen_at": row["last_seen_at"], "cancel_reason": row["cancel_reason"], "bound": bool(row["bound"])} for row in rows}
+
+    def take_captcha(self, job_id):
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT captcha_solution FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is not None and row["captcha_solution"] is not None:
+                db.execute("UPDATE jobs SET captcha_solution = NULL WHERE id = ?", (job_id,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return row["captcha_solution"] if row is not None else None
+
+    def _encrypt_credentials(self, username, password):
+        return self._fernet.encrypt(json.dumps({"username": username, "password": password}).encode())
+
+    def _decrypt_credentials(self, token):
+        if token is None:
+            return {"username": None, "password": None}
+        return json.loads(self._fernet.decrypt(token))
+
+    def finish(self, job_id):
+        self._connect().execute(
+            "UPDATE jobs SET state = 'finished', finished_at = ?, credentials = NULL, captcha_solution = NULL WHERE id = ?",
+            (time.time(), job_id),
+        )
+
+    def heartbeat(self, worker_id, stats):
+        self._connect().execute(
+            "INSERT INTO workers (id, heartbeat_at, stats) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at, stats = excluded.stats",
+            (worker_id, time.time(), json.dumps(stats)),
+        )
+
+    def recover_stale(self):
+        # Runs whose worker died go back to the queue, or fail once they have used up their attempts. The
+        # saved login and checkpoint are in the store, so the next worker carries on without a new CAPTCHA
+        # as long as the portal still accepts the cookies
+        cutoff = time.time() - WORKER_STALE_SECONDS
+        recovered = self._requeue(
+            "SELECT j.id, j.attempts, j.status, j.version FROM jobs j LEFT JOIN workers w ON w.id = j.worker_id "
+            "WHERE j.state = 'running' AND (w.heartbeat_at IS NULL OR w.heartbeat_at < ?)",
+            (cutoff,),
+            ("DELETE FROM workers WHERE heartbeat_at < ?", (cutoff,)),
+        )
+        if recovered:
+            logging.warning(f"Recovered {recovered} runs from stopped workers.")
+        return recovered
+
+    def release_worker(self, worker_id):
+        # A worker shutting down hands its unfinished runs back right away instead of waiting to go stale
+        return self._requeue(
+            "SELECT id, attempts, status, version FROM jobs WHERE state = 'running' AND worker_id = ?",
+            (worker_id,),
+            ("DELETE FROM workers WHERE id = ?", (worker_id,)),
+        )
+
+    def _requeue(self, select, params, cleanup):
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = db.execute(select, params).fetchall()
+            for row in rows:
+                status = json.loads(row["status"])
+                if row["attempts"] < JOB_MAX_ATTEMPTS:
+                    status.update(message="Worker stopped, run re-queued...", progress=0, captcha_ready=False)
+                    db.execute("UPDATE jobs SET state = 'queued', worker_id = NULL, status = ?, version = ? WHERE id = ?",
+                               (json.dumps(status), row["version"] + 1, row["id"]))
+                else:
+                    status.update(message="Automation failed: the worker running it stopped.", progress=-1, captcha_ready=False)
+                    db.execute("UPDATE jobs SET state = 'finished', finished_at = ?, credentials = NULL, status = ?, version = ? WHERE id = ?",
+                               (time.time(), json.dumps(status), row["version"] + 1, row["id"]))
+            db.execute(*cleanup)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def prune(self, retention=SESSION_RETENTION_SECONDS):
+        # Finished runs are kept this long so the frontend can read their final status
+        cutoff = time.time() - retention
+        db = self._connect()
+        db.execute("DELETE FROM images WHERE session_id IN (SELECT id FROM jobs WHERE state = 'finished' AND finished_at < ?)", (cutoff,))
+        db.execute("DELETE FROM images WHERE stored_at < ?", (cutoff,))
+        db.execute("DELETE FROM jobs WHERE state = 'finished' AND finished_at < ?", (cutoff,))
+        db.execute("DELETE FROM logins WHERE saved_at < ?", (time.time() - self.logins.ttl,))
+
+
+class StoredImages:
+    # ImageStore interface on top of the job store, so CAPTCHA images taken by a worker reach the web tier
+
+    def __init__(self, store):
+        self._store = store
+
+    def put(self, session_id, kind, png):
+        etag = hashlib.sha256(png).hexdigest()[:32]
+        self._store._connect().execute(
+            "INSERT OR REPLACE INTO images (session_id, kind, png, etag, stored_at) VALUES (?, ?, ?, ?, ?)",
+            (session_id, kind, png, etag, time.time()),
+        )
+        return etag
+
+    def get(self, session_id, kind):
+        row = self._store._connect().execute("SELECT png, etag FROM images WHERE session_id = ? AND kind = ?", (session_id, kind)).fetchone()
+        return (bytes(row["png"]), row["etag"]) if row else None
+
+    def delete(self, session_id, kind):
+        self._store._connect().execute("DELETE FROM images WHERE session_id = ? AND kind = ?", (session_id, kind))
+
+
+class StoredLogins(LoginCache):
+    # LoginCache on top of the job store, so a retry or a re-queued run finds the user's login and
+    # checkpoint whichever worker picks it up. Encrypted with the store's key, shared by every process
+
+    def __init__(self, store, ttl=LOGIN_CACHE_TTL_SECONDS, max_items=LOGIN_CACHE_MAX_ITEMS):
+        super().__init__(ttl=ttl, max_items=max_items, key=store.key)
+        self._store = store
+
+    def _load(self, user_key):
+        row = self._store._connect().execute("SELECT token FROM logins WHERE user_key = ?", (user_key,)).fetchone()
+        return bytes(row["token"]) if row else None
+
+    def _save(self, user_key, token):
+        db = self._store._connect()
+        db.execute("INSERT OR REPLACE INTO logins (user_key, token, saved_at) VALUES (?, ?, ?)", (user_key, token, time.time()))
+        db.execute("DELETE FROM logins WHERE user_key NOT IN (SELECT user_key FROM logins ORDER BY saved_at DESC LIMIT ?)", (self.max_items,))
+
+    def _drop(self, user_key, token):
+        self._store._connect().execute("DELETE FROM logins WHERE user_key = ? AND token = ?", (user_key, token))
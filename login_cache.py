@@ -0,0 +1,129 @@
+import os
+import json
+import hmac
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+from cryptography.fernet import Fernet, InvalidToken
+
+# A saved login (and checkpoint) is dropped once it has gone unused this long. ASP.NET sessions
+# expire after 20 idle minutes by default, so there is no point keeping cookies much longer
+LOGIN_CACHE_TTL_SECONDS = int(os.environ.get("LOGIN_CACHE_TTL_SECONDS", "1200"))
+# Upper bound on remembered users; the least recently used go first
+LOGIN_CACHE_MAX_ITEMS = int(os.environ.get("LOGIN_CACHE_MAX_ITEMS", "512"))
+# Fernet key (urlsafe base64, 32 bytes) of the in-memory cache used with RUN_BACKEND=inline. Without one a fresh
+# key is made per process, which is harmless since the entries die with the process anyway. Queue workers keep
+# logins in the job store instead (job_store.StoredLogins), encrypted with its key, so they survive restarts
+LOGIN_CACHE_KEY = os.environ.get("LOGIN_CACHE_KEY")
+
+
+class LoginCache:
+    # Authenticated portal cookies and run checkpoints per user, kept encrypted in memory.
+    # Entries are keyed by an HMAC of username and password, so a saved login is only ever handed
+    # back to someone presenting the same credentials, and neither is stored
+
+    def __init__(self, ttl=LOGIN_CACHE_TTL_SECONDS, max_items=LOGIN_CACHE_MAX_ITEMS, key=LOGIN_CACHE_KEY):
+        key = key.encode() if isinstance(key, str) else (key or Fernet.generate_key())
+        self.ttl = ttl
+        self.max_items = max_items
+        self._fernet = Fernet(key)
+        self._hmac_key = hashlib.sha256(b"login-cache-user-key" + key).digest()
+        self._lock = threading.Lock()
+        # user key -> Fernet token of the JSON entry; the token carries its own timestamp
+        self._entries = OrderedDict()
+
+    def user_key(self, username, password):
+        return hmac.new(self._hmac_key, f"{username}\0{password}".encode(), hashlib.sha256).hexdigest()
+
+    def get(self, user_key):
+        # Returns the entry dict, or None if there is none or it went unused for longer than the TTL
+        token = self._load(user_key)
+        if token is None:
+            return None
+        try:
+            return json.loads(self._fernet.decrypt(token, ttl=self.ttl))
+        except InvalidToken:
+            self._drop(user_key, token)
+            return None
+
+    def update(self, user_key, **changes):
+        # Merges the changes into the entry and re-encrypts it, which also restarts its TTL
+        entry = self.get(user_key) or {}
+        entry.update(changes)
+        self._save(user_key, self._fernet.encrypt(json.dumps(entry).encode()))
+
+    # Where the tokens live; overridden by job_store.StoredLogins
+
+    def _load(self, user_key):
+        with self._lock:
+            return self._entries.get(user_key)
+
+    def _save(self, user_key, token):
+        with self._lock:
+            self._entries.pop(user_key, None)
+            self._entries[user_key] = token
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def _drop(self, user_key, token):
+        # Only if nobody replaced the token in the meantime
+        with self._lock:
+            if self._entries.get(user_key) is token:
+                del self._entries[user_key]
+
+    def cookies(self, user_key):
+        # Returns (cookies, user_agent) of the saved login, or None
+        entry = self.get(user_key)
+        if not entry or not entry.get("cookies"):
+            return None
+        return entry["cookies"], entry.get("user_agent")
+
+    def store_login(self, user_key, cookies, user_agent):
+        self.update(user_key, cookies=cookies, user_agent=user_agent)
+
+    def forget_login(self, user_key):
+        # The portal no longer accepts the saved cookies; the checkpoint stays
+        self.update(user_key, cookies=None, user_agent=None)
+
+
+class RunCheckpoint:
+    # Which phases and rows a user's runs have already finished, saved after every step so an
+    # interrupted run picks up where it stopped. The portal's grid stays the source of truth: a
+    # row recorded here but still Pending is retried once more, not skipped
+
+    def __init__(self, cache, user_key):
+        self._cache = cache
+        self._user_key = user_key
+        entry = cache.get(user_key) or {}
+        self.phases_done = list(entry.get("phases_done", []))
+        self.submitted = {phase: list(keys) for phase, keys in entry.get("submitted", {}).items()}
+        if self.phases_done or self.submitted:
+            logging.info(f"Resuming from checkpoint: phases done {self.phases_done}, {sum(map(len, self.submitted.values()))} rows submitted.")
+
+    def is_phase_done(self, phase_name):
+        return phase_name in self.phases_done
+
+    def submitted_rows(self, phase_name):
+        return list(self.submitted.get(phase_name, []))
+
+    def row_submitted(self, phase_name, row_key):
+        rows = self.submitted.setdefault(phase_name, [])
+        if row_key not in rows:
+            rows.append(row_key)
+        self._save()
+
+    def phase_done(self, phase_name):
+        if phase_name not in self.phases_done:
+            self.phases_done.append(phase_name)
+        self._save()
+
+    def clear(self):
+        # Called once every phase is finished, so the next run starts from a fresh scan
+        self.phases_done = []
+        self.submitted = {}
+        self._save()
+
+    def _save(self):
+        self._cache.update(self._user_key, phases_done=self.phases_done, submitted=self.submitted)
@@ -0,0 +1,157 @@
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+# Histogram buckets in seconds: sub-second WebDriver steps up to multi-minute phases and human CAPTCHA waits
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        # [(labels, value), ...] in a JSON-friendly shape, for publishing from another process
+        with self._lock:
+            return [(labels, value) for labels, value in self._values.items()]
+
+    def render(self, extra=()):
+        # `extra` holds series from other processes, as produced by snapshot() and relabelled
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = list(self._values.items())
+        for labels, value in sorted(series + list(extra)):
+            lines.append(f"{self.name}{_label_text(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts..., sum, count]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [(labels, list(entry)) for labels, entry in self._values.items()]
+
+    def render(self, extra=()):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(entry)) for labels, entry in self._values.items()]
+        for labels, entry in sorted(series + list(extra)):
+            for bound, count in zip(self.buckets, entry):
+                lines.append(f"{self.name}_bucket{_label_text(labels + (('le', bound),))} {count}")
+            lines.append(f"{self.name}_bucket{_label_text(labels + (('le', '+Inf'),))} {entry[-1]}")
+            lines.append(f"{self.name}_sum{_label_text(labels)} {round(entry[-2], 6)}")
+            lines.append(f"{self.name}_count{_label_text(labels)} {entry[-1]}")
+        return lines
+
+
+span_seconds = Histogram("automation_span_seconds", "Time spent in each step of an automation run.")
+span_webdriver_calls = Counter("automation_span_webdriver_calls_total", "WebDriver (or HTTP) round trips made inside each step.")
+run_seconds = Histogram("automation_run_seconds", "Wall time of whole automation runs.")
+runs_total = Counter("automation_runs_total", "Finished automation runs by outcome.")
+METRICS = (span_seconds, span_webdriver_calls, run_seconds, runs_total)
+
+
+class RunTrace:
+    # Timed spans of one run, kept in order so the run can be inspected as a timeline
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, detail=None, source=None):
+        # `source` is anything with a round_trips counter (a pooled driver or the HTTP engine)
+        started = time.time()
+        calls_at_start = getattr(source, "round_trips", 0)
+        outcome = "ok"
+        try:
+            yield
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            calls = getattr(source, "round_trips", 0) - calls_at_start
+            self.record(name, started, time.time() - started, detail, calls, outcome)
+
+    def record(self, name, started, duration, detail=None, calls=0, outcome="ok"):
+        entry = {
+            "name": name,
+            "detail": detail,
+            "offset": round(started - self.started_at, 3),
+            "duration": round(duration, 3),
+            "webdriver_calls": calls,
+            "outcome": outcome,
+        }
+        with self._lock:
+            self.spans.append(entry)
+        span_seconds.observe(duration, span=name)
+        if calls:
+            span_webdriver_calls.inc(calls, span=name)
+
+    def to_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+        return {"started_at": self.started_at, "spans": spans}
+
+
+def record_run(outcome, duration):
+    runs_total.inc(outcome=outcome)
+    run_seconds.observe(duration)
+    logging.info(f"Run finished with outcome {outcome} in {duration:.1f}s.")
+
+
+def export_metrics():
+    # This process's histograms and counters as JSON-friendly data; queue workers publish it with their heartbeat
+    return {metric.name: metric.snapshot() for metric in METRICS}
+
+
+def render_metrics(gauges, remote=None):
+    # Prometheus text exposition: the histograms and counters above plus point-in-time gauges.
+    # `remote` maps a process name to its export_metrics(); those series are merged in with a worker label,
+    # so each worker's counters keep their own history across restarts
+    lines = []
+    for metric in METRICS:
+        extra = [
+            (tuple(sorted([tuple(pair) for pair in labels] + [("worker", worker_id)])), value)
+            for worker_id, exported in (remote or {}).items()
+            for labels, value in exported.get(metric.name, [])
+        ]
+        lines.extend(metric.render(extra))
+    for name, (help_text, value) in gauges.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,258 @@
+from flask import Flask, request, redirect, make_response, render_template_string
+import argparse
+import base64
+import random
+import secrets
+import threading
+import time
+
+# Offline stand-in for the student portal. It reproduces the pages and element ids the automation
+# relies on (login + CAPTCHA, StudentsCorner.aspx, the phase buttons, #gvCustomers, FeedBack.aspx)
+# so runs can be exercised and benchmarked without network access.
+
+# 8x8 grey PNG served as the CAPTCHA image
+CAPTCHA_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAgAAAAICAAAAADhZOFXAAAADklEQVR4nGPogAIGyhgAyIQiARb3A64AAAAASUVORK5CYII="
+)
+
+# Every mock page accepts this CAPTCHA answer
+MOCK_CAPTCHA_ANSWER = "12345"
+
+# Standard ASP.NET postback helper, so grid rows behave like the real portal's
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><title>{{ title }}</title>
+<link rel="stylesheet" href="Styles/site.css">
+<script>
+function __doPostBack(eventTarget, eventArgument) {
+    var form = document.forms[0];
+    form.__EVENTTARGET.value = eventTarget;
+    form.__EVENTARGUMENT.value = eventArgument;
+    form.submit();
+}
+</script></head>
+<body>
+<form method="post" action="{{ action }}" id="form1">
+<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="">
+<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="">
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{{ viewstate }}">
+<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="CA0B0334">
+<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="{{ eventvalidation }}">
+{{ body | safe }}
+</form>
+<img src="Images/banner.jpg" alt="">
+</body></html>"""
+
+LOGIN_BODY = """
+<input type="submit" name="BTN_GetCaptcha0" id="BTN_GetCaptcha0" value="Click To Get Captcha">
+<img id="Image2" src="{{ captcha_src }}" width="120" height="40" alt="captcha">
+<input type="text" name="txtVerificationCode" id="txtVerificationCode">
+<input type="text" name="TXTUSN" id="TXTUSN">
+<input type="password" name="TXTPASSWORD" id="TXTPASSWORD">
+<input type="submit" name="btn_Login" id="btn_Login" value="Login">
+<span id="lblMsg">{{ error }}</span>
+"""
+
+CORNER_BODY = """
+<a href="SubjectTeacher.aspx">Feedback</a>
+"""
+
+PHASES_BODY = """
+<input type="submit" name="btnPhase1Feedback" id="btnPhase1Feedback" value="Phase 1 Feedback">
+<input type="submit" name="btnPhase2Feedback" id="btnPhase2Feedback" value="Phase 2 Feedback">
+{% if items is not none %}
+<table id="gvCustomers"><tbody>
+<tr><th>Sl</th><th>Subject</th><th>Teacher</th><th>Status</th></tr>
+{% for item in items %}
+<tr onclick="javascript:__doPostBack('gvCustomers','Select${{ loop.index0 }}')" style="cursor:pointer">
+<td>{{ loop.index }}</td><td>{{ item.subject }}</td><td>{{ item.teacher }}</td><td>{{ item.status }}</td></tr>
+{% endfor %}
+</tbody></table>
+{% endif %}
+"""
+
+FEEDBACK_BODY = """
+{% for q in range(1, questions + 1) %}
+<div>Question {{ q }}
+{% for option in range(ratings) %}
+<input type="radio" name="rdQ{{ q }}" id="rdQ{{ q }}_{{ option }}" value="{{ option }}"><label for="rdQ{{ q }}_{{ option }}">{{ option }}</label>
+{% endfor %}
+</div>
+{% endfor %}
+<input type="submit" name="btn_submit" id="btn_submit" value="Submit">
+"""
+
+DONE_BODY = """
+<span>Feedback saved.</span>
+<a id="HyperLink1" href="SubjectTeacher.aspx">Next Faculty</a>
+"""
+
+
+def create_portal(items_per_phase=5, questions=10, ratings=5, latency_ms=0, jitter_ms=0,
+                  login_failure_rate=0.0, submit_failure_rate=0.0, seed=None):
+    # Builds a mock portal Flask app. Latency is added to every page; the failure rates make a
+    # login or a feedback submission silently fail (the item then stays Pending)
+    portal = Flask(__name__)
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    # cookie token -> {"user": ..., "phases": {"Phase 1": [items], ...}, "phase": ..., "open_item": ...}
+    logins = {}
+    # cookie token -> True once the CAPTCHA has been requested on that browser
+    captcha_requested = {}
+    stats = {"logins": 0, "submissions": 0, "failed_submissions": 0}
+    portal.config["MOCK_STATS"] = stats
+
+    def new_items():
+        return {
+            phase: [{"subject": f"{phase} Subject {i + 1}", "teacher": f"Teacher {i + 1}", "status": "Pending"} for i in range(items_per_phase)]
+            for phase in ("Phase 1", "Phase 2")
+        }
+
+    def delay():
+        if latency_ms or jitter_ms:
+            time.sleep((latency_ms + rng.uniform(0, jitter_ms)) / 1000.0)
+
+    def page(title, body, action, **context):
+        html = render_template_string(
+            PAGE_TEMPLATE,
+            title=title,
+            action=action,
+            viewstate=base64.b64encode(secrets.token_bytes(48)).decode(),
+            eventvalidation=base64.b64encode(secrets.token_bytes(24)).decode(),
+            body=render_template_string(body, **context),
+        )
+        return make_response(html)
+
+    def visitor():
+        return request.cookies.get("ASP.NET_SessionId")
+
+    def with_visitor(response):
+        if not visitor():
+            response.set_cookie("ASP.NET_SessionId", secrets.token_hex(12), path="/")
+        return response
+
+    def require_postback_state():
+        # Real ASP.NET rejects postbacks without view state; so does the mock
+        if "__VIEWSTATE" not in request.form or "__EVENTVALIDATION" not in request.form:
+            return make_response("Invalid postback or callback argument.", 500)
+        return None
+
+    @portal.route("/Students/SubjectTeacher.aspx", methods=["GET", "POST"])
+    def subject_teacher():
+        delay()
+        token = visitor()
+        with lock:
+            login = logins.get(token)
+        if login is None:
+            return with_visitor(login_page(token))
+
+        error = require_postback_state() if request.method == "POST" else None
+        if error is not None:
+            return error
+
+        items = None
+        if request.method == "POST":
+            if "btnPhase1Feedback" in request.form:
+                login["phase"] = "Phase 1"
+            elif "btnPhase2Feedback" in request.form:
+                login["phase"] = "Phase 2"
+            elif request.form.get("__EVENTTARGET") == "gvCustomers" and login.get("phase"):
+                index = int(request.form.get("__EVENTARGUMENT", "Select$-1").split("$")[1])
+                login["open_item"] = (login["phase"], index)
+                return redirect("FeedBack.aspx")
+            if login.get("phase"):
+                items = login["phases"][login["phase"]]
+        return page("Subject Teacher", PHASES_BODY, "SubjectTeacher.aspx", items=items)
+
+    def login_page(token):
+        error = ""
+        if request.method == "POST":
+            failure = require_postback_state()
+            if failure is not None:
+                return failure
+            if "BTN_GetCaptcha0" in request.form:
+                captcha_requested[token] = True
+            elif "btn_Login" in request.form:
+                ok = (
+                    request.form.get("txtVerificationCode") == MOCK_CAPTCHA_ANSWER
+                    and request.form.get("TXTUSN")
+                    and request.form.get("TXTPASSWORD")
+                    and rng.random() >= login_failure_rate
+                )
+                if ok:
+                    with lock:
+                        logins[token] = {"user": request.form["TXTUSN"], "phases": new_items(), "phase": None}
+                        stats["logins"] += 1
+                    return redirect("StudentsCorner.aspx")
+                error = "Invalid Captcha or Login Credentials"
+        captcha_src = f"CaptchaImage.aspx?n={secrets.token_hex(4)}" if captcha_requested.get(token) else "StudentLogin.aspx"
+        return page("Student Login", LOGIN_BODY, "SubjectTeacher.aspx", captcha_src=captcha_src, error=error)
+
+    @portal.route("/Students/StudentsCorner.aspx")
+    def students_corner():
+        delay()
+        if visitor() not in logins:
+            return redirect("SubjectTeacher.aspx")
+        return page("Students Corner", CORNER_BODY, "StudentsCorner.aspx")
+
+    @portal.route("/Students/FeedBack.aspx", methods=["GET", "POST"])
+    def feedback():
+        delay()
+        login = logins.get(visitor())
+        if login is None or not login.get("open_item"):
+            return redirect("SubjectTeacher.aspx")
+        if request.method == "GET":
+            return page("Feedback", FEEDBACK_BODY, "FeedBack.aspx", questions=questions, ratings=ratings)
+
+        error = require_postback_state()
+        if error is not None:
+            return error
+        phase, index = login.pop("open_item")
+        answered = all(request.form.get(f"rdQ{q}") is not None for q in range(1, questions + 1))
+        with lock:
+            if answered and rng.random() >= submit_failure_rate:
+                login["phases"][phase][index]["status"] = "Submitted"
+                stats["submissions"] += 1
+            else:
+                stats["failed_submissions"] += 1
+        return page("Feedback", DONE_BODY, "FeedBack.aspx")
+
+    @portal.route("/Students/CaptchaImage.aspx")
+    def captcha_image():
+        delay()
+        response = make_response(CAPTCHA_PNG)
+        response.headers["Content-Type"] = "image/png"
+        return response
+
+    @portal.route("/Students/StudentLogin.aspx")
+    def placeholder_image():
+        # The real login page's Image2 points here before a CAPTCHA is requested
+        return make_response(b"", 404)
+
+    @portal.route("/Students/Styles/site.css")
+    def stylesheet():
+        delay()
+        response = make_response("body { font-family: sans-serif; }")
+        response.headers["Content-Type"] = "text/css"
+        return response
+
+    @portal.route("/Students/Images/banner.jpg")
+    def banner():
+        delay()
+        response = make_response(CAPTCHA_PNG)
+        response.headers["Content-Type"] = "image/png"
+        return response
+
+    return portal
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the offline mock of the student portal.")
+    parser.add_argument("--port", type=int, default=8084)
+    parser.add_argument("--items", type=int, default=5, help="Pending feedback items per phase")
+    parser.add_argument("--latency-ms", type=int, default=0, help="Delay added to every page")
+    parser.add_argument("--jitter-ms", type=int, default=0, help="Random extra delay on top of --latency-ms")
+    parser.add_argument("--login-failure-rate", type=float, default=0.0)
+    parser.add_argument("--submit-failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    create_portal(args.items, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                  login_failure_rate=args.login_failure_rate, submit_failure_rate=args.submit_failure_rate).run(port=args.port, threaded=True)
@@ -0,0 +1,77 @@
+import os
+import time
+import threading
+import logging
+
+# How long the preflight waits for its browser before giving up
+PREFLIGHT_TIMEOUT_SECONDS = int(os.environ.get("PREFLIGHT_TIMEOUT_SECONDS", "120"))
+
+
+def check_binaries():
+    # CHROME_BIN and CHROMEDRIVER_PATH are optional, but when set they have to point at something runnable
+    from driver_pool import CHROME_BIN, CHROMEDRIVER_PATH
+    found = {}
+    for name, path in (("CHROME_BIN", CHROME_BIN), ("CHROMEDRIVER_PATH", CHROMEDRIVER_PATH)):
+        if not path:
+            found[name] = None # Left to Selenium Manager
+            continue
+        if not os.path.isfile(path) or not os.access(path, os.X_OK):
+            raise RuntimeError(f"{name} is set to {path}, which is not an executable file.")
+        found[name] = path
+    return found
+
+
+def check_browser(pool, timeout=PREFLIGHT_TIMEOUT_SECONDS):
+    # Gets one browser from the pool and hands it back, so it stays warm for the first real run
+    driver = pool.acquire(timeout=timeout)
+    try:
+        return driver.execute_script("return navigator.userAgent;")
+    finally:
+        pool.release(driver)
+
+
+class Preflight:
+    # Startup checks for a process that runs automation: imports the automation modules (and with them
+    # Selenium), checks the browser binaries and starts one browser. Until they pass the process
+    # reports itself not ready, so no traffic reaches an instance that cannot launch Chrome
+
+    def __init__(self, load_automation):
+        # load_automation imports and returns the automation module
+        self._load_automation = load_automation
+        self.state = "pending"
+        self.error = None
+        # check name -> seconds it took
+        self.timings = {}
+        self.details = {}
+
+    def start(self):
+        threading.Thread(target=self.run, name="preflight", daemon=True).start()
+        return self
+
+    def run(self):
+        # Returns True once every check passed
+        try:
+            automation = self._timed("import", self._load_automation)
+            self.details["binaries"] = self._timed("binaries", check_binaries)
+            self.details["user_agent"] = self._timed("browser", lambda: check_browser(automation.driver_pool))
+            self.state = "ready"
+            logging.info(f"Preflight passed in {sum(self.timings.values()):.2f}s: {self.timings}")
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            logging.error(f"Preflight failed: {e}")
+        return self.ready
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def to_dict(self):
+        return {"state": self.state, "error": self.error, "timings": dict(self.timings), **self.details}
+
+    def _timed(self, name, check):
+        started = time.time()
+        try:
+            return check()
+        finally:
+            self.timings[name] = round(time.time() - started, 3)
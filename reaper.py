@@ -0,0 +1,162 @@
+import os
+import signal
+import threading
+import time
+import logging
+
+from driver_pool import BROWSER_MARKER
+
+# How often the reaper runs
+REAPER_INTERVAL_SECONDS = float(os.environ.get("REAPER_INTERVAL_SECONDS", "10"))
+# A run nobody has asked about for this long is treated as abandoned (tab closed). Status streams
+# check in at least every keep-alive, and polling clients every couple of seconds
+ABANDONED_AFTER_SECONDS = int(os.environ.get("ABANDONED_AFTER_SECONDS", "120"))
+# Hard ceiling on a single run, whatever it is doing
+RUN_MAX_SECONDS = int(os.environ.get("RUN_MAX_SECONDS", "1800"))
+# Browser processes are only considered orphaned once they are at least this old, so launches in flight are left alone
+ORPHAN_GRACE_SECONDS = int(os.environ.get("ORPHAN_GRACE_SECONDS", "60"))
+# Expected footprint of one headless browser and memory kept free for everything else
+BROWSER_MEMORY_MB = int(os.environ.get("BROWSER_MEMORY_MB", "300"))
+MEMORY_RESERVE_MB = int(os.environ.get("MEMORY_RESERVE_MB", "256"))
+
+# Process names (as in /proc/<pid>/comm, cut to 15 characters) of Chrome and chromedriver
+BROWSER_PROCESS_NAMES = ("chromedriver", "chrome", "chromium", "chromium-browse", "headless_shell")
+
+
+def available_memory_mb():
+    # Memory this process can still use: the container's cgroup limit when there is one, otherwise the host's
+    candidates = []
+    for limit_path, usage_path in (
+        ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"), # cgroup v2
+        ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes"), # cgroup v1
+    ):
+        try:
+            with open(limit_path) as f:
+                limit = f.read().strip()
+            with open(usage_path) as f:
+                usage = int(f.read().strip())
+        except (OSError, ValueError):
+            continue
+        # "max" (v2) or a huge number (v1) means no limit
+        if limit.isdigit() and int(limit) < 1 << 60:
+            candidates.append((int(limit) - usage) / 1024 / 1024)
+        break
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    candidates.append(int(line.split()[1]) / 1024)
+                    break
+    except OSError:
+        pass
+    return min(candidates) if candidates else None
+
+
+def browser_limit(live_browsers):
+    # How many browsers fit: the ones running now plus whatever the free memory can hold
+    available = available_memory_mb()
+    if available is None:
+        return None
+    return max(1, int(live_browsers + (available - MEMORY_RESERVE_MB) // BROWSER_MEMORY_MB))
+
+
+def _proc_stat(pid):
+    # (name, parent pid, start time in seconds since boot) from /proc, or None if the process is gone
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The name is in parentheses and may itself contain spaces or parentheses
+    name = stat[stat.index("(") + 1:stat.rindex(")")]
+    fields = stat[stat.rindex(")") + 2:].split()
+    return name, int(fields[1]), int(fields[19]) / os.sysconf("SC_CLK_TCK")
+
+
+def _launched_by_pool(pid):
+    # True if the process carries the pool's marker in its environment (inherited by Chrome from chromedriver)
+    try:
+        with open(f"/proc/{pid}/environ", "rb") as f:
+            return f"{BROWSER_MARKER}=1".encode() in f.read().split(b"\0")
+    except OSError:
+        return False
+
+
+def find_orphaned_browsers(owned_pids):
+    # Chrome/chromedriver processes a browser pool of this app launched that nobody will ever quit: reparented
+    # to init after their owner died, or chromedrivers started by this process that the pool no longer knows
+    # about. Browsers anything else started (a desktop Chrome, other tools) never match
+    if not os.path.isdir("/proc"):
+        return []
+    with open("/proc/uptime") as f:
+        uptime = float(f.read().split()[0])
+    me, uid = os.getpid(), os.getuid()
+    orphans = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        pid = int(entry)
+        stat = _proc_stat(pid)
+        if stat is None:
+            continue
+        name, parent, started = stat
+        if name not in BROWSER_PROCESS_NAMES or uptime - started < ORPHAN_GRACE_SECONDS:
+            continue
+        try:
+            if os.stat(f"/proc/{pid}").st_uid != uid:
+                continue
+        except OSError:
+            continue
+        if not (parent == 1 or (parent == me and name == "chromedriver" and pid not in owned_pids)):
+            continue
+        if _launched_by_pool(pid):
+            orphans.append((pid, name))
+    return orphans
+
+
+class Reaper:
+    # Background housekeeping for one process that runs automation: cancels abandoned and overlong runs,
+    # kills orphaned browser processes and keeps the browser pool within what memory allows
+
+    def __init__(self, live_sessions, pool, interval=REAPER_INTERVAL_SECONDS):
+        # live_sessions returns the sessions of this process that have not finished
+        self.live_sessions = live_sessions
+        self.pool = pool
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="reaper", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.warning(f"Reaper sweep failed: {e}")
+
+    def sweep(self):
+        now = time.time()
+        for session in self.live_sessions():
+            if session.cancelled:
+                continue
+            # Only a run parked on the CAPTCHA needs its user; once logged in it may as well finish unwatched
+            if session.captcha_ready_event.is_set() and now - session.last_seen_at > ABANDONED_AFTER_SECONDS:
+                session.cancel(f"nobody has checked on the run for {ABANDONED_AFTER_SECONDS} seconds")
+            elif now - session.created_at > RUN_MAX_SECONDS:
+                session.cancel(f"the run exceeded {RUN_MAX_SECONDS} seconds")
+
+        for pid, name in find_orphaned_browsers(set(self.pool.browser_pids())):
+            logging.warning(f"Killing orphaned {name} process {pid}.")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+        limit = browser_limit(self.pool.stats()["total"])
+        if limit is not None:
+            self.pool.set_limit(limit)
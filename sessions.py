@@ -0,0 +1,260 @@
+import os
+import threading
+import time
+import queue # Import queue for inter-thread communication
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import RunTrace, record_run
+
+# How many automation runs may drive a browser at the same time
+MAX_CONCURRENT_RUNS = int(os.environ.get("MAX_CONCURRENT_RUNS", "2"))
+# How many further runs may wait in the admission queue before we refuse new ones
+MAX_QUEUED_RUNS = int(os.environ.get("MAX_QUEUED_RUNS", "10"))
+# Finished sessions are kept this long so the frontend can read the final status
+SESSION_RETENTION_SECONDS = int(os.environ.get("SESSION_RETENTION_SECONDS", "600"))
+# "http" replays the feedback postbacks without a browser after login, "selenium" drives Chrome throughout.
+# Kept here rather than in automation.py so the web tier can validate requests without importing Selenium
+ENGINES = ("http", "selenium")
+DEFAULT_ENGINE = os.environ.get("DEFAULT_ENGINE", "http")
+# Which option of every rating question gets selected: the N in rdQ{question}_{N}
+DEFAULT_RATING = os.environ.get("DEFAULT_RATING", "4")
+# How many prefetched sessions may hold a browser while waiting for credentials. Whatever is set here,
+# at least one run slot is always left for runs that have credentials (see warm_session_cap)
+MAX_WARM_SESSIONS = int(os.environ.get("MAX_WARM_SESSIONS", str(max(0, MAX_CONCURRENT_RUNS - 1))))
+
+
+def warm_session_cap(capacity):
+    # Prefetched sessions allowed next to `capacity` run slots; 0 turns prefetching off
+    return max(0, min(MAX_WARM_SESSIONS, capacity - 1))
+
+
+class CapacityError(Exception):
+    # Raised when both the worker pool and the admission queue are full
+    pass
+
+
+class RunCancelled(Exception):
+    # Raised inside a run once it has been cancelled (by the user, the CAPTCHA deadline or the reaper)
+    pass
+
+
+class AutomationSession:
+    # Everything one automation run needs: its own status, CAPTCHA channel and driver
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.created_at = time.time()
+        self.finished_at = None
+        # Guards status/report; waiters are woken whenever either changes
+        self._lock = threading.Condition()
+        # Bumped on every status change so clients can tell whether they are up to date
+        self.version = 0
+        self.status = {"message": "Idle", "progress": 0, "captcha_ready": False}
+        # Queue to pass CAPTCHA solution from Flask route to the Selenium thread
+        self.captcha_solution_queue = queue.Queue()
+        # Event to signal that the CAPTCHA is ready for input
+        self.captcha_ready_event = threading.Event()
+        # Event to signal the Selenium thread that CAPTCHA input has been received
+        self.captcha_submitted_event = threading.Event()
+        # The WebDriver instance used by this run
+        self.driver = None
+        # Per-phase figures (round trips, submissions) added as each phase ends, and every submitted
+        # row as it happens
+        self.report = {"phases": [], "items": []}
+        # Timed spans (driver acquire, page load, CAPTCHA, login, phases, forms) of this run
+        self.trace = RunTrace()
+        # Last time a client asked about this run; the reaper cancels runs nobody is watching any more
+        self.last_seen_at = time.time()
+        # Set with a reason when the run should stop at its next checkpoint
+        self.cancel_reason = None
+        # A prefetched session runs ahead to the CAPTCHA and stays warm until credentials are bound to it
+        self.warm = False
+        self.credentials = None
+        self.credentials_event = threading.Event()
+
+    def update(self, message, progress=None, captcha_ready=False):
+        with self._lock:
+            if progress is None:
+                progress = self.status["progress"]
+            self.status = {"message": message, "progress": progress, "captcha_ready": captcha_ready}
+            self._bump()
+
+    def get_status(self):
+        with self._lock:
+            status = dict(self.status)
+            status["report"] = self.report_snapshot()
+            status["version"] = self.version
+            status["warm"] = self.warm
+        status["session_id"] = self.id
+        return status
+
+    def add_phase_report(self, phase_report):
+        with self._lock:
+            self.report["phases"].append(phase_report)
+            self._bump()
+
+    def add_report_item(self, item):
+        # Published right away, so clients see each row without waiting for its phase to end
+        with self._lock:
+            self.report["items"].append(item)
+            self._bump()
+
+    def report_snapshot(self):
+        # Caller must hold the lock
+        return {"phases": list(self.report["phases"]), "items": list(self.report["items"])}
+
+    def mark_finished(self):
+        with self._lock:
+            self.finished_at = time.time()
+            self._bump()
+
+    def wait_for_change(self, seen_version, timeout):
+        # Blocks until the status moves past seen_version (or timeout), returns the current version
+        with self._lock:
+            self._lock.wait_for(lambda: self.version != seen_version, timeout=timeout)
+            return self.version
+
+    def _bump(self):
+        # Caller must hold the lock
+        self.version += 1
+        self._lock.notify_all()
+
+    @property
+    def progress(self):
+        with self._lock:
+            return self.status["progress"]
+
+    @property
+    def is_finished(self):
+        return self.finished_at is not None
+
+    def submit_captcha(self, solution):
+        self.captcha_solution_queue.put(solution)
+        self.captcha_submitted_event.set()
+
+    def reset_captcha_events(self):
+        self.captcha_ready_event.clear()
+        self.captcha_submitted_event.clear()
+
+    def bind_credentials(self, username, password, engine, rating):
+        # Hands the user's credentials to a prefetched run; False if it is not waiting for any
+        with self._lock:
+            if not self.warm or self.cancelled or self.is_finished:
+                return False
+            self.credentials = (username, password, engine, rating)
+            self.warm = False
+            self._bump()
+        self.credentials_event.set()
+        return True
+
+    def wait_for_credentials(self, timeout):
+        # Returns (username, password, engine, rating), or None if nothing was bound in time or the run was cancelled
+        self.credentials_event.wait(timeout)
+        return self.credentials
+
+    def touch(self):
+        self.last_seen_at = time.time()
+
+    def cancel(self, reason):
+        # Asks the run to stop; wakes it if it is parked on the CAPTCHA
+        if self.cancel_reason is None:
+            self.cancel_reason = reason
+            logging.info(f"Cancelling session {self.id}: {reason}")
+        # Wake the run wherever it is parked: on credentials or on the CAPTCHA
+        self.credentials_event.set()
+        self.captcha_submitted_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_reason is not None
+
+    def raise_if_cancelled(self):
+        if self.cancel_reason is not None:
+            raise RunCancelled(self.cancel_reason)
+
+
+class SessionManager:
+    # Runs automation sessions on a bounded thread pool with an admission queue in front of it
+
+    def __init__(self, max_workers=MAX_CONCURRENT_RUNS, max_queued=MAX_QUEUED_RUNS):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="automation")
+        # One slot per running or queued run; acquiring fails once both are full
+        self._admission = threading.BoundedSemaphore(max_workers + max_queued)
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._active = 0
+        self._queued = 0
+
+    def create_session(self):
+        self._prune()
+        session = AutomationSession(uuid.uuid4().hex)
+        with self._lock:
+            self._sessions[session.id] = session
+        return session
+
+    def get(self, session_id):
+        if not session_id:
+            return None
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def live_sessions(self):
+        with self._lock:
+            return [s for s in self._sessions.values() if not s.is_finished]
+
+    def discard(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def submit(self, session, target, *args):
+        if not self._admission.acquire(blocking=False):
+            self.discard(session.id)
+            raise CapacityError("Server is at capacity. Please try again in a minute.")
+
+        with self._lock:
+            self._queued += 1
+            must_wait = self._active + self._queued > self.max_workers
+        if must_wait:
+            session.update("Queued, waiting for a free browser slot...", 0)
+
+        def run():
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+            started = time.time()
+            session.trace.record("queue_wait", session.created_at, started - session.created_at)
+            outcome = "error"
+            try:
+                result = target(session, *args)
+                if isinstance(result, dict) and result.get("status") in ("success", "cancelled"):
+                    outcome = result["status"]
+                return result
+            finally:
+                record_run(outcome, time.time() - started)
+                session.mark_finished()
+                with self._lock:
+                    self._active -= 1
+                self._admission.release()
+
+        return self._executor.submit(run)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def counts(self):
+        with self._lock:
+            return {"active": self._active, "queued": self._queued, "sessions": len(self._sessions)}
+
+    def _prune(self):
+        # Drop finished sessions once the frontend has had time to read their final status
+        cutoff = time.time() - SESSION_RETENTION_SECONDS
+        with self._lock:
+            expired = [sid for sid, s in self._sessions.items() if s.finished_at and s.finished_at < cutoff]
+            for sid in expired:
+                del self._sessions[sid]
+        if expired:
+            logging.info(f"Pruned {len(expired)} finished automation sessions.")
@@ -0,0 +1,44 @@
+#!/bin/sh
+# Container entry point.
+#
+# RUN_BACKEND=queue (the default here) starts WORKER_PROCESSES worker.py processes next to gunicorn; they
+# share the job store at JOB_STORE_PATH on the container's disk, and gunicorn may run any number of
+# workers (WEB_CONCURRENCY). RUN_BACKEND=inline runs the automation on threads inside a single gunicorn worker.
+set -e
+
+PORT="${PORT:-8000}"
+export RUN_BACKEND="${RUN_BACKEND:-queue}"
+pids=""
+
+if [ "$RUN_BACKEND" = "queue" ]; then
+    i=0
+    while [ "$i" -lt "${WORKER_PROCESSES:-1}" ]; do
+        python worker.py &
+        pids="$pids $!"
+        i=$((i + 1))
+    done
+fi
+
+# Threaded workers so long-lived status streams do not tie up the whole worker
+gunicorn app:app --bind "0.0.0.0:$PORT" --worker-class gthread --threads 16 &
+pids="$pids $!"
+
+stop() {
+    # Pass SIGTERM on so workers re-queue their runs and gunicorn drains, then wait for all of them to exit
+    kill -TERM $pids 2>/dev/null || true
+    wait
+    exit "$1"
+}
+trap 'stop 0' TERM INT
+
+# If any process exits (say a worker whose browser check failed), take the rest down with it so the
+# container stops and the orchestrator restarts it, instead of serving with nothing to run the automation
+while :; do
+    for pid in $pids; do
+        if ! kill -0 "$pid" 2>/dev/null; then
+            echo "Process $pid exited, stopping the container." >&2
+            stop 1
+        fi
+    done
+    sleep 2
+done
@@ -0,0 +1,103 @@
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException, WebDriverException
+import os
+
+# How often conditions are re-checked while waiting
+WAIT_POLL_SECONDS = float(os.environ.get("WAIT_POLL_SECONDS", "0.1"))
+
+# Seconds each named step may take before it is treated as failed.
+# Any of them can be overridden with WAIT_<STEP>_SECONDS, e.g. WAIT_LOGIN_REDIRECT_SECONDS=30
+DEFAULT_BUDGETS = {
+    "page_load": 30,
+    "captcha_button": 10,
+    "captcha_image": 20,
+    "login_form": 15,
+    "login_redirect": 20,
+    # Optional lookups (error labels and the like) should fail fast, not stall the run
+    "probe": 2,
+    "navigation": 30,
+    "grid": 30,
+    "feedback_form": 30,
+}
+
+# True once the image has been fetched and decoded, not merely inserted into the DOM
+IMAGE_LOADED_SCRIPT = """
+const img = document.getElementById(arguments[0]);
+if (!img) { return false; }
+const src = img.getAttribute('src') || '';
+return img.complete && img.naturalWidth > 0 && src !== '' && !arguments[1].includes(src);
+"""
+
+# Text of the first element among the given ids that is visible and not empty, or null
+VISIBLE_TEXT_SCRIPT = """
+for (const id of arguments[0]) {
+    const el = document.getElementById(id);
+    if (el && el.offsetParent !== null && el.innerText.trim()) { return el.innerText.trim(); }
+}
+return null;
+"""
+
+# Remembers the element's current src and tags the page, so a later check can tell a reload or swap happened
+MARK_SRC_SCRIPT = """
+const el = document.getElementById(arguments[0]);
+window.__waitPolicySrc = el ? el.src : '';
+"""
+
+# True once the tagged page has been replaced (postback) or the element's src differs from the remembered one
+SRC_CHANGED_SCRIPT = """
+if (window.__waitPolicySrc === undefined) { return true; }
+const el = document.getElementById(arguments[0]);
+return el !== null && el.src !== window.__waitPolicySrc;
+"""
+
+
+def _budgets_from_env():
+    budgets = dict(DEFAULT_BUDGETS)
+    for step in budgets:
+        value = os.environ.get(f"WAIT_{step.upper()}_SECONDS")
+        if value:
+            budgets[step] = float(value)
+    return budgets
+
+
+class WaitPolicy:
+    # Named per-step wait budgets for one driver, so each step waits on a real condition for as long as it deserves
+
+    def __init__(self, driver, budgets=None, poll=WAIT_POLL_SECONDS):
+        self.driver = driver
+        self.budgets = budgets or _budgets_from_env()
+        self.poll = poll
+
+    def wait(self, step):
+        return WebDriverWait(self.driver, self.budgets[step], poll_frequency=self.poll)
+
+    def until(self, step, condition):
+        return self.wait(step).until(condition)
+
+    def document_ready(self, step="page_load"):
+        # The DOM is parsed and scripts have run; sub-resources (images, styles) are waited for per element, so
+        # this also holds under the eager page-load strategy without waiting on everything the page references
+        return self.until(step, lambda d: d.execute_script("return document.readyState;") in ("interactive", "complete"))
+
+    def image_loaded(self, element_id, step, placeholder_srcs=()):
+        return self.until(step, lambda d: d.execute_script(IMAGE_LOADED_SCRIPT, element_id, list(placeholder_srcs)))
+
+    def src_changed_after(self, element_id, action, step):
+        # Runs the action, then waits until it has either posted the page back or swapped the element's src
+        self.driver.execute_script(MARK_SRC_SCRIPT, element_id)
+        action()
+
+        def changed(d):
+            try:
+                return d.execute_script(SRC_CHANGED_SCRIPT, element_id)
+            except WebDriverException:
+                return False # Page is mid-navigation
+        return self.until(step, changed)
+
+    def probe_text(self, element_ids, step="probe"):
+        # Fast fail-path for optional elements: checks every id in one round trip and
+        # gives up after the short probe budget instead of waiting on each id in turn
+        try:
+            return self.until(step, lambda d: d.execute_script(VISIBLE_TEXT_SCRIPT, list(element_ids)))
+        except TimeoutException:
+            return None
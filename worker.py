@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+import uuid
+import signal
+import socket
+import logging
+import threading
+from concurrent import futures
+
+import automation
+from sessions import AutomationSession, SessionManager, MAX_CONCURRENT_RUNS
+from driver_pool import DRIVER_POOL_PREWARM
+from job_store import JobStore
+from reaper import Reaper
+from preflight import Preflight
+from metrics import export_metrics
+
+# Runs queued by the web tier (RUN_BACKEND=queue) are executed here, away from the gunicorn workers.
+#
+#   RUN_BACKEND=queue gunicorn app:app ...   # web tier, any number of workers
+#   python worker.py                         # one or more of these on the same host, see start.sh
+
+# How many runs this worker drives at the same time (each needs a browser for at least the login)
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", str(MAX_CONCURRENT_RUNS)))
+# How often the worker looks for new runs and CAPTCHA answers
+WORKER_POLL_SECONDS = float(os.environ.get("WORKER_POLL_SECONDS", "0.25"))
+# How often the worker reports in; must stay well below WORKER_STALE_SECONDS
+WORKER_HEARTBEAT_SECONDS = float(os.environ.get("WORKER_HEARTBEAT_SECONDS", "5"))
+
+
+class StoredSession(AutomationSession):
+    # A session whose status and trace are written to the job store on every change,
+    # so any web process can serve them
+
+    def __init__(self, job, store):
+        super().__init__(job["id"])
+        self._store = store
+        self.detached = False
+        # Queue wait starts when the run was submitted, not when this worker picked it up
+        self.created_at = job["created_at"]
+        self.trace.started_at = job["created_at"]
+        # Carry on from the stored version so clients never see it go backwards after a re-queue
+        self.version = job["version"]
+        self.warm = job["username"] is None
+
+    def _bump(self):
+        super()._bump()
+        if self.detached:
+            return
+        status = dict(self.status)
+        status["report"] = self.report_snapshot()
+        status["warm"] = self.warm
+        self._store.save_status(self.id, status, self.version, self.trace.to_dict())
+
+    def mark_finished(self):
+        super().mark_finished()
+        if not self.detached:
+            self._store.finish(self.id)
+
+
+class Worker:
+    def __init__(self, store, concurrency=WORKER_CONCURRENCY):
+        self.id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.store = store
+        self.concurrency = concurrency
+        self.sessions = SessionManager(max_workers=concurrency, max_queued=0)
+        # job id -> (StoredSession, future) of the runs this worker is executing
+        self.running = {}
+        self._stopping = threading.Event()
+
+    def run(self):
+        # CAPTCHA and failure screenshots have to reach the web tier, so they go to the shared store
+        automation.run_images = self.store.images
+        # Saved logins and checkpoints too, so a retry or a re-queued run can land on any worker
+        automation.login_cache = self.store.logins
+        if DRIVER_POOL_PREWARM:
+            automation.driver_pool.start()
+        # Don't report in (and so look ready to the web tier) or claim runs until a browser can start
+        if not Preflight(lambda: automation).run():
+            automation.driver_pool.shutdown()
+            return False
+        Reaper(lambda: [session for session, _ in list(self.running.values())], automation.driver_pool).start()
+        logging.info(f"Worker {self.id} started with {self.concurrency} run slots.")
+
+        last_heartbeat = 0
+        while not self._stopping.is_set():
+            if time.time() - last_heartbeat >= WORKER_HEARTBEAT_SECONDS:
+                # Check in before claiming anything, or other workers would treat our runs as orphaned
+                self.heartbeat()
+                self.store.recover_stale()
+                self.store.prune()
+                last_heartbeat = time.time()
+            self.relay_captchas()
+            self.claim_jobs()
+            self._stopping.wait(WORKER_POLL_SECONDS)
+        self.shutdown()
+        return True
+
+    def stop(self, *_):
+        self._stopping.set()
+
+    def heartbeat(self):
+        self.store.heartbeat(self.id, {
+            "capacity": self.concurrency,
+            "running": len(self.running),
+            "pool": automation.driver_pool.stats(),
+            # The web tier serves /metrics, so the run and span histograms of this process travel with the heartbeat
+            "metrics": export_metrics(),
+        })
+
+    def claim_jobs(self):
+        # A future is only done once its run has given back its SessionManager slot
+        for job_id in [job_id for job_id, (_, future) in self.running.items() if future.done()]:
+            del self.running[job_id]
+        while len(self.running) < self.concurrency and not self._stopping.is_set():
+            job = self.store.claim(self.id)
+            if job is None:
+                return
+            session = StoredSession(job, self.store)
+            future = self.sessions.submit(session, automation.run_feedback_automation_task, job["username"], job["password"], job["engine"], job["rating"])
+            self.running[job["id"]] = (session, future)
+            logging.info(f"Worker {self.id} picked up run {job['id']}.")
+
+    def relay_captchas(self):
+        # Answers, credentials, cancellations and client check-ins recorded by any web process land
+        # in the store; hand them to the runs here
+        running = {job_id: session for job_id, (session, _) in list(self.running.items())}
+        for job_id, signals in self.store.run_signals(list(running)).items():
+            session = running[job_id]
+            if signals["last_seen_at"]:
+                session.last_seen_at = max(session.last_seen_at, signals["last_seen_at"])
+            if signals["cancel_reason"] and not session.cancelled:
+                session.cancel(signals["cancel_reason"])
+            if signals["bound"] and session.warm:
+                credentials = self.store.credentials(job_id)
+                if credentials:
+                    session.bind_credentials(*credentials)
+        for session in running.values():
+            if session.captcha_ready_event.is_set() and not session.captcha_submitted_event.is_set():
+                solution = self.store.take_captcha(session.id)
+                if solution:
+                    session.submit_captcha(solution)
+
+    def shutdown(self):
+        # Stop the runs first and only hand them back to the queue once they have stopped: an HTTP-engine
+        # run past login holds no browser to quit and would otherwise keep submitting next to its re-queued copy
+        runs = list(self.running.values())
+        logging.info(f"Worker {self.id} stopping, cancelling {len(runs)} runs.")
+        for session, _ in runs:
+            session.detached = True # Keep the cancellation out of the store; the run is re-queued below
+            driver = session.driver
+            if driver is not None:
+                try:
+                    driver.quit()
+                except Exception:
+                    pass
+            # Wakes a run parked on the CAPTCHA or, if prefetched, on its credentials, and stops it at its next check
+            session.cancel("the worker is stopping")
+        pending = [future for _, future in runs]
+        while pending:
+            # Keep reporting in, or other workers would take the runs over before they have stopped
+            self.heartbeat()
+            pending = list(futures.wait(pending, timeout=WORKER_HEARTBEAT_SECONDS).not_done)
+        for session, future in runs:
+            result = future.result() if future.exception() is None else None
+            if isinstance(result, dict) and result.get("status") == "success":
+                # Finished before it reached a cancellation check; record that instead of running it again
+                session.detached = False
+                session.mark_finished()
+        requeued = self.store.release_worker(self.id)
+        logging.info(f"Worker {self.id} stopped, re-queued {requeued} unfinished runs.")
+        self.sessions.shutdown(wait=True)
+        automation.driver_pool.shutdown()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    worker = Worker(JobStore())
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    if not worker.run():
+        sys.exit(1)